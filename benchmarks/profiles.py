@@ -0,0 +1,62 @@
+# Copyright 2020 Артём Воронов
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Writes/sec of every tuning profile from settings.db_profiles and of SQLite defaults.
+# Usage: python -m benchmarks.profiles [writes]
+import os
+import sys
+import tempfile
+import time
+from modules.database import DataBase
+from settings import db_profiles
+
+MEMBERS = 1000
+
+
+def prepare(profile):
+    gdb = DataBase(f"data/databases/{profile or 'default'}.db", pragmas=db_profiles.get(profile))
+    gdb.create_table("Members", "tag", "money REAL NOT NULL", "organization")
+    gdb.increment_many("Members", "id", "money", [(i, 0, f"member{i}") for i in range(MEMBERS)], ("tag",))
+    return gdb
+
+
+def single_writes(gdb, writes):
+    started = time.perf_counter()
+    for i in range(writes):
+        gdb.increment("Members", "id", i % MEMBERS, "money", 0.5)  # commit per write
+    return writes / (time.perf_counter() - started)
+
+
+def batched_writes(gdb, writes, batch=500):
+    started = time.perf_counter()
+    for start in range(0, writes, batch):
+        rows = [(i % MEMBERS, 0.5, f"member{i % MEMBERS}") for i in range(start, min(start + batch, writes))]
+        gdb.increment_many("Members", "id", "money", rows, ("tag",))
+    return writes / (time.perf_counter() - started)
+
+
+def main(writes=2000):
+    print(f"{'profile':<10}{'single writes/s':>18}{'batched writes/s':>20}")
+    for profile in [None, *db_profiles]:
+        gdb = prepare(profile)
+        single = single_writes(gdb, writes)
+        batched = batched_writes(gdb, writes * 10)
+        gdb.close()
+        print(f"{profile or 'default':<10}{single:>18.0f}{batched:>20.0f}")
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        main(*map(int, sys.argv[1:]))
@@ -0,0 +1,260 @@
+# Copyright 2020 Артём Воронов
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Ops/sec and p50/p99 latency of the DataBase layer and of the economy commands on synthetic guilds.
+# Commands run offline on stub discord objects, so they need discord.py installed but no token or connection.
+# Usage: python -m benchmarks.suite [--sizes 1000 10000 100000 1000000] [--ops 2000] [--output results.json]
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+from modules.database import DataBase
+from modules.schema import GUILD_MIGRATIONS
+from settings import db_profiles
+
+ORGS = 1000
+SHOP_ROLES = 60
+
+
+class Result:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.latencies = []
+        self.elapsed = 0.0
+
+    def to_dict(self):
+        latencies = sorted(self.latencies)
+        return {
+            "name": self.name,
+            "size": self.size,
+            "ops": len(latencies),
+            "ops_per_sec": round(len(latencies) / self.elapsed, 1) if self.elapsed else None,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 4),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 4),
+        }
+
+    def __str__(self):
+        data = self.to_dict()
+        return f"{data['name']:<24}{data['size']:>10}{data['ops_per_sec']:>14}{data['p50_ms']:>12}{data['p99_ms']:>12}"
+
+
+def percentile(latencies, p):
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, len(latencies) * p // 100)]
+
+
+def measure(name, size, operation, ops):
+    result = Result(name, size)
+    started = time.perf_counter()
+    for i in range(ops):
+        op_started = time.perf_counter()
+        operation(i)
+        result.latencies.append(time.perf_counter() - op_started)
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+async def measure_async(name, size, operation, ops):
+    result = Result(name, size)
+    started = time.perf_counter()
+    for i in range(ops):
+        op_started = time.perf_counter()
+        await operation(i)
+        result.latencies.append(time.perf_counter() - op_started)
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def member_rows(size):
+    return ((i, random.randint(0, 10000) / 2, f"member{i}") for i in range(size))
+
+
+def org_rows():
+    return [(f"org {i}", random.randint(0, 1000), random.randint(0, 100)) for i in range(ORGS)]
+
+
+def shop_rows():
+    return [(role_id, random.randint(1, 10000)) for role_id in range(1, SHOP_ROLES + 1)]
+
+
+def database_benchmarks(size, ops):
+    gdb = DataBase(f"data/databases/bench_{size}.db", pragmas=db_profiles["guild"])
+    gdb.migrate(GUILD_MIGRATIONS)
+    gdb.increment_many("Members", "id", "money", list(member_rows(size)), ("tag",))
+    gdb.insert_many("Orgs", "name, points, rep", org_rows())
+    gdb.insert_many("Shop", "id, price", shop_rows())
+
+    results = [
+        measure("db.read", size, lambda i: gdb.read("Members", "id", random.randrange(size)), ops),
+        measure("db.rank", size, lambda i: gdb.rank("Members", "money", random.randint(0, 10000) / 2), ops),
+        measure("db.increment", size,
+                lambda i: gdb.increment("Members", "id", random.randrange(size), "money", 0.5), ops),
+        measure("db.increment_many", size,
+                lambda i: gdb.increment_many("Members", "id", "money",
+                                             [(random.randrange(size), 0.5, "") for _ in range(500)], ("tag",)),
+                max(1, ops // 100)),
+        measure("db.read_all_by_order", size, lambda i: gdb.read_all_by_order("Shop", "price"), ops),
+    ]
+    gdb.close()
+    return results
+
+
+class Stub:
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class StubRole(Stub):
+    def __init__(self, role_id):
+        super().__init__(id=role_id, mention=f"<@&{role_id}>")
+
+
+class StubGuild(Stub):
+    def __init__(self, guild_id):
+        super().__init__(id=guild_id, name=f"guild {guild_id}")
+
+    def get_role(self, role_id):
+        return StubRole(role_id)
+
+
+class StubMember(Stub):
+    def __init__(self, member_id):
+        super().__init__(id=member_id, name=f"member{member_id}", mention=f"<@{member_id}>", bot=False, roles=[],
+                         avatar_url="", guild_permissions=Stub(administrator=True))
+
+
+class StubMessage(Stub):
+    def __init__(self, guild, author, content):
+        super().__init__(guild=guild, author=author, content=content, mentions=[])
+
+    async def edit(self, **kwargs):
+        pass
+
+
+class StubContext(Stub):
+    def __init__(self, guild, author, content=""):
+        message = StubMessage(guild, author, content)
+        super().__init__(guild=guild, author=author, message=message)
+
+    async def send(self, content=None, **kwargs):
+        return self.message
+
+
+class StubPaginator:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def start(self):
+        pass
+
+
+async def economy_benchmarks(bot_module, size, ops):
+    guild = StubGuild(size)
+    gdb = await bot_module.guild_databases.get(guild.id)
+    rows = list(member_rows(size))
+    for start in range(0, size, 100000):
+        await gdb.increment_many("Members", "id", "money", rows[start:start + 100000], ("tag",))
+    await gdb.insert_many("Orgs", "name, points, rep", org_rows())
+    await gdb.insert_many("Shop", "id, price", shop_rows())
+
+    async def on_message(i):
+        message = StubMessage(guild, StubMember(random.randrange(size)), "hello")
+        await bot_module.on_message(message)
+
+    async def profile(i):
+        await bot_module.profile.callback(StubContext(guild, StubMember(random.randrange(size))))
+
+    async def shop(i):
+        await bot_module.shop.callback(StubContext(guild, StubMember(0)))
+
+    async def give_guild_points(i):
+        await bot_module.give_guild_points.callback(StubContext(guild, StubMember(0)), f"org {i % ORGS}", "5")
+
+    return [
+        await measure_async("on_message", size, on_message, ops * 10),
+        await measure_async("profile", size, profile, ops),
+        await measure_async("shop", size, shop, ops),
+        await measure_async("give_guild_points", size, give_guild_points, ops),
+    ]
+
+
+async def run_economy(sizes, ops):
+    try:
+        import main as bot_module
+    except ImportError as e:
+        print(f"Skipping economy benchmarks: {e}")
+        return []
+    bot_module.Paginator = StubPaginator  # a real paginator waits for reactions until its timeout
+    results = []
+    for size in sizes:
+        for result in await economy_benchmarks(bot_module, size, ops):
+            print(result)
+            results.append(result)
+    await bot_module.accrual.flush_all(bot_module.guild_databases.get)
+    await bot_module.guild_databases.close_all()
+    await bot_module.db.close()
+    return results
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(sizes, ops, output):
+    random.seed(0)
+    print(f"{'benchmark':<24}{'members':>10}{'ops/s':>14}{'p50 ms':>12}{'p99 ms':>12}")
+    results = []
+    for size in sizes:
+        for result in database_benchmarks(size, ops):
+            print(result)
+            results.append(result)
+    results += asyncio.run(run_economy(sizes, ops))
+
+    report = {
+        "commit": commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "ops": ops,
+        "results": [result.to_dict() for result in results],
+    }
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="DataBase and economy benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000],
+                        help="Members per synthetic guild")
+    parser.add_argument("--ops", type=int, default=2000, help="Operations per benchmark")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file for the results")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        main(args.sizes, args.ops, output)
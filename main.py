@@ -11,22 +11,56 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import time
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
+from modules.accrual import AccrualBuffer
 from modules.baselogger import get_logger
-from modules.database import DataBase
-from modules.Paginator import Paginator
-from settings import TOKEN, db_path
+from modules.database import AsyncDataBase
+from modules.guildconfig import GuildConfigCache
+from modules.guilddatabases import GuildDataBases, SharedGuildDataBases
+from modules.helpcatalog import HelpCatalog
+from modules.ledger import Ledger, cutoff
+from modules.locks import KeyedLocks
+from modules import metrics
+from modules.Paginator import Paginator, PageSource
+from modules.rewards import RewardLimiter
+from modules.router import CommandRouter
+from modules.schema import BOT_MIGRATIONS, GUILD_MIGRATIONS, SHARED_GUILD_MIGRATIONS
+from modules.shopcatalog import ShopCatalog
+from modules.startup import StartupReport, prepare_guilds
+from settings import TOKEN, db_path, db_workers, db_profiles, max_open_guild_databases, guild_storage, shared_db_path, \
+    preload_guild_databases, bootstrap_concurrency, accrual_flush_interval, accrual_flush_threshold, \
+    ledger_keep_days, ledger_compact_interval, reward_amount, \
+    metrics_port, metrics_file, metrics_file_interval
 log = get_logger("bot")
-db = DataBase(db_path)
+db = AsyncDataBase(db_path, workers=db_workers, pragmas=db_profiles["bot"])
+accrual = AccrualBuffer(accrual_flush_threshold)
+member_locks = KeyedLocks()
+reward_limiter = RewardLimiter()
+guild_configs = GuildConfigCache(db)
 
-guild_databases = {}
-custom_prefixes = {}
 default_prefixes = ['>']
 
 
-def create_user(gdb, new_user_id, new_user_name, money=0.0):
-    gdb.insert("Members", columns="id, tag, money", values=f"{new_user_id}, '{new_user_name}', {money}")
+async def prepare_guild_database(gdb):
+    await gdb.migrate(GUILD_MIGRATIONS)
+
+
+async def prepare_shared_database(shared_db):
+    await shared_db.migrate(SHARED_GUILD_MIGRATIONS)
+
+if guild_storage == "shared":
+    guild_databases = SharedGuildDataBases(shared_db_path, prepare_shared_database, db_profiles["shared"])
+else:
+    guild_databases = GuildDataBases("data/databases/{}.db", prepare_guild_database, max_open_guild_databases,
+                                     db_profiles["guild"])
+shop_catalog = ShopCatalog(guild_databases)
+ledger = Ledger(shared=guild_storage == "shared")
+
+
+async def create_user(gdb, new_user_id, new_user_name, money=0.0):
+    await gdb.insert("Members", columns="id, tag, money", values=(new_user_id, new_user_name, money))
 
 
 def to_float_or_int(num):
@@ -36,58 +70,107 @@ def to_float_or_int(num):
         return int(float(num))
 
 
+def to_signed(num):
+    return f"{'+' if num >= 0 else '-'}{to_float_or_int(abs(num))}"
+
+
 def check_admin(ctx):
     if ctx.author.guild_permissions.administrator:
         return True
-    guild_data = db.read("Guilds", "id", ctx.guild.id)
-    if guild_data[2]:
-        roles_list = str(guild_data[2]).split(";")
-        for role in roles_list:
-            if ctx.guild.get_role(int(role)) in ctx.author.roles:
-                return True
-    return False
+    admin_roles = guild_configs.get(ctx.guild.id).admin_roles
+    return not admin_roles.isdisjoint(role.id for role in ctx.author.roles)
+
+
+def guild_prefix(guild):
+    if guild and guild_configs.get(guild.id).prefixes:
+        return guild_configs.get(guild.id).prefixes[0]
+    return default_prefixes[0]
 
 
 async def get_prefix(bot, message):
-    guild = message.guild
-    if guild:
-        return custom_prefixes.get(guild.id, default_prefixes)
-    return default_prefixes
+    return list(router.prefixes(message.guild))
+
+
+help_catalog = HelpCatalog(lambda command: check_admin in command.checks)
+command_seconds = metrics.registry.histogram("bot_command_seconds", "Time of command invocations", ("command",))
+messages_processed = metrics.registry.counter("bot_messages_total", "Guild messages processed", ("guild",))
+for stat in ("open", "hits", "opens", "evictions"):
+    metrics.registry.gauge(f"bot_guild_databases_{stat}", f"Guild databases {stat} (see GuildDataBases.stats)",
+                           callback=lambda stat=stat: guild_databases.stats.get(stat, 0))
+
+
+class UlvicationBot(commands.Bot):
+    metrics_server = None
+
+    async def invoke(self, ctx):
+        started = time.perf_counter()
+        try:
+            await super().invoke(ctx)
+        finally:
+            if ctx.command:
+                command_seconds.observe(time.perf_counter() - started, ctx.command.qualified_name)
+
+    def add_command(self, command):
+        super().add_command(command)
+        help_catalog.refresh(self.commands)
+
+    def remove_command(self, name):
+        command = super().remove_command(name)
+        help_catalog.refresh(self.commands)
+        return command
+
+    async def close(self):
+        await accrual.flush_all(guild_databases.get)  # don't lose buffered rewards on shutdown
+        await guild_databases.close_all()
+        await db.close()
+        if self.metrics_server:
+            self.metrics_server.close()
+        await super().close()
+
 
 intents = discord.Intents.default()
 intents.members = True
-bot = commands.Bot(command_prefix=get_prefix, intents=intents)
+bot = UlvicationBot(command_prefix=get_prefix, intents=intents)
+router = CommandRouter(bot, guild_configs, default_prefixes)
 bot.remove_command("help")
 
 
+@tasks.loop(seconds=accrual_flush_interval)
+async def flush_accruals():
+    reward_limiter.sweep()
+    await accrual.flush_all(guild_databases.get)
+
+
+@tasks.loop(seconds=ledger_compact_interval)
+async def compact_ledger():
+    before = cutoff(ledger_keep_days)
+    for guild_id in guild_databases.opened():  # idle guilds are compacted when they are used again
+        if guild_id in guild_databases:
+            await ledger.compact(await guild_databases.get(guild_id), guild_id, before)
+
+
+@tasks.loop(seconds=metrics_file_interval)
+async def write_metrics():
+    await metrics.write_file(metrics_file)
+
+
 @bot.event
 async def on_connect():
     log.info(f"{bot.user} has connected to Discord! Preparing...")
-
-    db.create_table("Guilds", "prefix", "admin_roles")
-    db_guilds = db.read_all("Guilds", "id, prefix")
-    if db_guilds:  # if we have at lest one guild in database
-        guilds = {}
-
-        for g in db_guilds:
-            guilds[g[0]] = g[1]  # {guild_id: guild_prefix}
-
-        for bot_guild in bot.guilds:
-            guild_databases[bot_guild.id] = DataBase(f"data/databases/{bot_guild.id}.db")
-            guild_databases[bot_guild.id].create_table("Members", "tag", "money REAL NOT NULL", "organization")
-            guild_databases[bot_guild.id].create_table("Orgs", "name NOT NULL UNIQUE", "points INT NOT NULL",
-                                                       "rep INT NOT NULL",
-                                                       id_replace="id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE NOT NULL")
-            guild_databases[bot_guild.id].create_table("Shop", "price INT NOT NULL")
-            if bot_guild.id not in guilds:  # if we don't have this guild in database
-                db.insert("Guilds", "id", f"{bot_guild.id}")
-            elif guilds[bot_guild.id]:
-                custom_prefixes[bot_guild.id] = guilds[bot_guild.id] or default_prefixes
-
-    else:
-        for bot_guild in bot.guilds:
-            db.insert("Guilds", "id", f"{bot_guild.id}")
-            custom_prefixes[bot_guild.id] = default_prefixes
+    report = StartupReport()
+
+    with report.phase("bot database"):
+        await db.migrate(BOT_MIGRATIONS)
+    with report.phase("guild configs"):
+        await guild_configs.load()
+        new_guilds = [bot_guild.id for bot_guild in bot.guilds if bot_guild.id not in guild_configs]
+        if new_guilds:  # if we don't have these guilds in database
+            await guild_configs.add_many(new_guilds)
+        router.clear()  # messages received before the configs were loaded cached the default prefixes
+    with report.phase("guild databases"):  # the rest of guild databases are opened on first use
+        preload = [bot_guild.id for bot_guild in bot.guilds[:preload_guild_databases]]
+        await prepare_guilds(preload, guild_databases, bootstrap_concurrency, report)
+    report.log()
 
     cur_activity = discord.Game("Stardew Valley")
     await bot.change_presence(status=discord.Status.online, activity=cur_activity)
@@ -96,6 +179,17 @@ async def on_connect():
 @bot.event
 async def on_ready():
     log.info(f"{bot.user} is done preparing the data. Now we online!")
+    if not flush_accruals.is_running():
+        flush_accruals.start()
+    if not compact_ledger.is_running():
+        compact_ledger.start()
+    if metrics_port and bot.metrics_server is None:
+        try:
+            bot.metrics_server = await metrics.start_http_server(metrics_port)
+        except OSError as e:  # e.g. the port is taken, the bot works without metrics
+            log.error(f"Can't serve metrics on port {metrics_port}: {e}")
+    if metrics_file and not write_metrics.is_running():
+        write_metrics.start()
 
 
 @bot.event
@@ -111,13 +205,19 @@ async def on_resumed():
 @bot.event
 async def on_guild_join(guild):
     log.info(f"{bot.user} has joined a new guild! Preparing...")
-    guild_databases[guild.id] = DataBase(f"data/databases/{guild.id}.db")
-    guild_databases[guild.id].create_table("Members", "tag", "money REAL NOT NULL", "organization")
-    guild_databases[guild.id].create_table("Orgs", "name NOT NULL UNIQUE", "points INT NOT NULL", "rep INT NOT NULL",
-                                           id_replace="id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE NOT NULL")
-    guild_databases[guild.id].create_table("Shop", "price INT NOT NULL")
+    await guild_databases.get(guild.id)
+
+    await guild_configs.add(guild.id)
 
-    db.insert("Guilds", "id", f"{guild.id}")
+
+@bot.event
+async def on_guild_role_delete(role):
+    shop_catalog.invalidate_role(role)
+
+
+@bot.event
+async def on_guild_role_update(before, after):
+    shop_catalog.invalidate_role(after)
 
 
 @bot.event
@@ -142,47 +242,52 @@ async def on_command_error(ctx, error):
 
 @bot.event
 async def on_message(message):
-    if not message.guild:  # if message sent in private messages with bot
-        await bot.process_commands(message)
-    else:
-        message_prefix = default_prefixes[0]
-        if message.guild.id in custom_prefixes:
-            message_prefix = custom_prefixes[message.guild.id]
-
-        if message.content.startswith(message_prefix):  # if message is our bot's command we raise it
-            await bot.process_commands(message)
-
-        elif not message.author.bot:  # if the author is not a bot
-            gdb = guild_databases[message.guild.id]
-            user = gdb.read("Members", "id", message.author.id)
-            if user:
-                gdb.update("Members", "id", message.author.id, "money", user[2]+0.5)  # Updating member money
-            else:
-                create_user(gdb, message.author.id, message.author.name, 0.5)
-
-
-@bot.command(name="set_prefix", help="Назначить префикс для команд на этом сервере")
+    if message.guild:
+        messages_processed.inc(message.guild.id)
+    prefix = router.match(message)
+    if prefix is not None:  # if message is our bot's command we raise it
+        await router.dispatch(message, prefix)
+
+    elif message.guild and not message.author.bot:  # if the author is not a bot
+        policy = guild_configs.get(message.guild.id)
+        if len(message.content) >= policy.reward_min_length and \
+                reward_limiter.allow(message.guild.id, message.author.id, reward_amount, policy):
+            if accrual.add(message.guild.id, message.author.id, message.author.name, reward_amount):
+                await accrual.flush_guild(message.guild.id, await guild_databases.get(message.guild.id))
+
+
+@bot.command(name="set_prefix", usage="[prefix;prefix...]",
+             help="Назначить префикс для команд на этом сервере, несколько префиксов разделяются ;")
 @commands.guild_only()
 @commands.check(check_admin)
 async def set_prefix(ctx, *, prefix):
-    db.update("Guilds", "id", ctx.guild.id, "prefix", f"'{prefix}'")
-    custom_prefixes[ctx.guild.id] = prefix
+    old_prefix = guild_prefix(ctx.guild)
+    await guild_configs.set_prefix(ctx.guild.id, prefix)
+    help_catalog.forget(old_prefix)
+    router.invalidate(ctx.guild.id)
     await ctx.send("Prefix set!")
 
 
+@bot.command(name="set_reward_policy", aliases=["rewardpolicy"],
+             usage="[window seconds] [max coins per window] [min message length]",
+             help="Настраивает начисление монет за сообщения: не больше max монет за window секунд, 0 секунд - без лимита")
+@commands.guild_only()
+@commands.check(check_admin)
+async def set_reward_policy(ctx, window: to_float_or_int, limit: to_float_or_int, min_length: int):
+    await guild_configs.set_reward_policy(ctx.guild.id, window, limit, min_length)
+    await ctx.send(f"Reward policy set: up to {limit} coins per {window} seconds for messages "
+                   f"of {min_length}+ characters!")
+
+
 @bot.command(name="add_manager_role", aliases=["set_manager_role"],
              usage="[role mention]", help="Дает роли доступ к командам администрирования")
 @commands.guild_only()
 @commands.check(check_admin)
 async def add_manager_role(ctx, role: discord.Role):
-    guild_data = db.read("Guilds", "id", ctx.guild.id)
-    roles_list = list()
-    if guild_data[2]:
-        roles_list = str(guild_data[2]).split(";")
-    roles_list.append(str(role.id))
-
-    db.update("Guilds", "id", ctx.guild.id, "admin_roles", f"'{';'.join(roles_list)}'")
-    await ctx.send(f"{role.mention} теперь администрирует бота!")
+    if await guild_configs.add_admin_role(ctx.guild.id, role.id):
+        await ctx.send(f"{role.mention} теперь администрирует бота!")
+    else:
+        await ctx.send(f"{role.mention} уже администрирует бота!")
 
 
 @bot.command(name="remove_manager_role", aliases=["delete_manager_role", "rem_manager_role"],
@@ -190,14 +295,10 @@ async def add_manager_role(ctx, role: discord.Role):
 @commands.guild_only()
 @commands.check(check_admin)
 async def remove_manager_role(ctx, role: discord.Role):
-    guild_data = db.read("Guilds", "id", ctx.guild.id)
-    if guild_data[2]:
-        roles_list = str(guild_data[2]).split(";")
-        try:
-            roles_list.remove(str(role.id))
-            db.update("Guilds", "id", ctx.guild.id, "admin_roles", f"'{';'.join(roles_list)}'")
+    if guild_configs.get(ctx.guild.id).admin_roles:
+        if await guild_configs.remove_admin_role(ctx.guild.id, role.id):
             await ctx.send(f"{role.mention} больше не является администрирующей ролью!")
-        except ValueError:
+        else:
             await ctx.send(f"{role.mention} не является администрирующей ролью! Это точно нужная роль?")
     else:
         await ctx.send(f"Для этого сервера не заданы администрирующие роли. Вы можете добавить его командой add_manager_role!")
@@ -208,12 +309,13 @@ async def remove_manager_role(ctx, role: discord.Role):
 @commands.guild_only()
 @commands.check(check_admin)
 async def manager_roles(ctx):
-    guild_data = db.read("Guilds", "id", ctx.guild.id)
-    if guild_data[2]:
-        roles_list = str(guild_data[2]).split(";")
+    admin_roles = guild_configs.get(ctx.guild.id).admin_roles
+    if admin_roles:
         roles_string = f"*Роли, адмиинтрирующие бота на этом сервере:*"
-        for role in roles_list:
-            roles_string = roles_string + "\n> " + ctx.guild.get_role(int(role)).mention
+        for role in admin_roles:
+            role_obj = ctx.guild.get_role(role)
+            if role_obj:
+                roles_string = roles_string + "\n> " + role_obj.mention
         await ctx.send(roles_string)
     else:
         await ctx.send(f"Для этого сервера не заданы администрирующие роли. Вы можете добавить его командой add_manager_role!")
@@ -223,12 +325,12 @@ async def manager_roles(ctx):
              usage="[guild_name]", help="Задает гильдию, в которой вы состоите")
 @commands.guild_only()
 async def set_guild(ctx, *, org_name):
-    gdb = guild_databases[ctx.guild.id]
-    org_data = gdb.read("Orgs", "name", f"'{org_name}'")
+    gdb = await guild_databases.get(ctx.guild.id)
+    org_data = await gdb.read("Orgs", "name", org_name)
     if org_data:
-        if not gdb.read("Members", "id", ctx.author.id):
-            create_user(gdb, ctx.author.id, ctx.author.name)
-        gdb.update("Members", "id", ctx.author.id, "organization", f"'{org_name}'")
+        if not await gdb.read("Members", "id", ctx.author.id):
+            await create_user(gdb, ctx.author.id, ctx.author.name)
+        await gdb.update("Members", "id", ctx.author.id, "organization", org_name)
         embed = discord.Embed(title=f"Теперь вы в гильдии {org_data[1]}!", color=discord.Colour.from_rgb(254, 254, 254))
         embed.set_image(url="https://media1.tenor.com/images/f8539f656d2ed90be7cd3bbe95d263d2/tenor.gif")
         await ctx.send(embed=embed)
@@ -254,28 +356,29 @@ async def profile(ctx, *args):
     else:
         member = ctx.author
 
-    gdb = guild_databases[ctx.message.guild.id]
-    user_data = gdb.read("Members", "id", member.id)
+    gdb = await guild_databases.get(ctx.message.guild.id)
+    await accrual.flush_member(ctx.guild.id, member.id, gdb)  # so the rank is of the shown coins
+    user_data = await gdb.read("Members", "id", member.id)
     if not user_data:
-        create_user(gdb, member.id, member.name)
-        user_data = gdb.read("Members", "id", member.id)
+        await create_user(gdb, member.id, member.name)
+        user_data = await gdb.read("Members", "id", member.id)
 
+    user_money = user_data[2]
     user_organization = ":crossed_swords: Гильдия: -"
 
     if user_data[3]:
-        org_data = gdb.read("Orgs", "name", f"'{user_data[3]}'")
+        org_data = await gdb.read("Orgs", "name", user_data[3])
         if org_data:
             user_organization = f"\n:crossed_swords: Гильдия: {org_data[1]}\n" \
                                 f":low_brightness: Очки: {org_data[2]}\n" \
                                 f":military_medal: Репутанция: {org_data[3]}"
 
-    rating_list = gdb.read_all_by_order("Members", "money", mod="DESC")
-    rating_place = rating_list.index(user_data) + 1
+    rating_place = await gdb.rank("Members", "money", user_data[2])
 
     embed = discord.Embed(color=discord.Colour.from_rgb(254, 254, 254))
     embed.set_thumbnail(url=member.avatar_url)
     embed.add_field(name=f"**Профиль пользователя**", value=member.mention, inline=False)
-    embed.add_field(name=f":coin: Монеты: {to_float_or_int(user_data[2])}\n"
+    embed.add_field(name=f":coin: Монеты: {to_float_or_int(user_money)}\n"
                          f":crown: Рейтинг: {rating_place}\n"
                          f"{user_organization}",
                     value=" ‌‌‍‍", inline=False)
@@ -289,30 +392,75 @@ async def profile(ctx, *args):
 #     pass
 
 
-# @bot.command(name="guilds", help="Показывает список всех гильдий сервера")
-# @commands.guild_only()
-# async def guilds(ctx):
-#     gdb = guild_databases[ctx.message.guild.id]
-#     guild_org_list = gdb.read_all_by_order("Orgs", "points", mod="DESC")
-#     if guild_org_list:
-#         embeds = []
-#         embed = discord.Embed(title=f"**Гильдии сервера**\n{ctx.guild.name}", color=discord.Colour.from_rgb(254, 254, 254))
-#         embed_counter = 1
-#         for org in guild_org_list:
-#             embed.add_field(name=org[1], value=f":low_brightness:{org[2]}  •:military_medal:{org[3]}", inline=False)
-#             if embed_counter % 5 == 0:
-#                 embeds.append(embed)
-#                 embed = discord.Embed(title=f"**Гильдии сервера**\n{ctx.guild.name}", color=discord.Colour.from_rgb(254, 254, 254))
-#             embed_counter += 1
-#         if (embed_counter - 1) % 5 != 0:
-#             embeds.append(embed)
-#         message = await ctx.send(embed=embeds[0])
-#         page = Paginator(bot, message, use_more=False, embeds=embeds)
-#         await page.start()
-#     else:
-#         embed = discord.Embed(title=f"Список гильдий для этого сервера пуст :(", color=discord.Colour.from_rgb(254, 254, 254))
-#         embed.set_image(url="https://media1.tenor.com/images/a00ad898a26dbb80abb5cd3fc846fa4e/tenor.gif?itemid=16025185")
-#         await ctx.send(embed=embed)
+async def keyset_source(gdb, table, order_key, page_size, render, columns_to_read="*"):
+    """
+    PageSource over a table sorted by order_key in descending order. Each viewed page is one DataBase.read_page
+    :param render: Callable of (rows, page index) returning the embed of a page
+    :return: PageSource or None if the table is empty
+    """
+    count = await gdb.count(table)
+    if not count:
+        return None
+    cursors = {0: None}  # {page index: cursor}, paginator moves page by page, so the cursor of a page is always known
+
+    async def page(index):
+        if index not in cursors:  # an earlier page was the last one, the table shrank since count
+            return render([], index)
+        result = await gdb.read_page(table, order_key, page_size, cursors[index], columns_to_read)
+        if result is None:
+            return render([], index)
+        rows, cursor = result
+        for later in [i for i in cursors if i > index]:
+            del cursors[later]
+        if cursor is not None:
+            cursors[index + 1] = cursor
+        return render(rows, index)
+
+    return PageSource((count + page_size - 1) // page_size, page)
+
+
+@bot.command(name="top", aliases=["leaderboard"], help="Показывает рейтинг участников сервера по монетам")
+@commands.guild_only()
+async def top(ctx):
+    gdb = await guild_databases.get(ctx.message.guild.id)
+
+    def render(rows, index):
+        embed = discord.Embed(title=f"**Рейтинг сервера**\n{ctx.guild.name}", color=discord.Colour.from_rgb(254, 254, 254))
+        for place, (member_id, tag, money) in enumerate(rows, index * 10 + 1):
+            embed.add_field(name=f"{place}. {tag or member_id}", value=f":coin: {to_float_or_int(money)}", inline=False)
+        return embed
+
+    source = await keyset_source(gdb, "Members", "money", 10, render, "id, tag, money")
+    if source:
+        message = await ctx.send(embed=await source.get(0))
+        page = Paginator(bot, message, use_more=False, source=source)
+        await page.start()
+    else:
+        embed = discord.Embed(title=f"Рейтинг этого сервера пуст :(", color=discord.Colour.from_rgb(254, 254, 254))
+        embed.set_image(url="https://media1.tenor.com/images/a00ad898a26dbb80abb5cd3fc846fa4e/tenor.gif?itemid=16025185")
+        await ctx.send(embed=embed)
+
+
+@bot.command(name="guilds", help="Показывает список всех гильдий сервера")
+@commands.guild_only()
+async def guilds(ctx):
+    gdb = await guild_databases.get(ctx.message.guild.id)
+
+    def render(rows, index):
+        embed = discord.Embed(title=f"**Гильдии сервера**\n{ctx.guild.name}", color=discord.Colour.from_rgb(254, 254, 254))
+        for org in rows:
+            embed.add_field(name=org[0], value=f":low_brightness:{org[1]}  •:military_medal:{org[2]}", inline=False)
+        return embed
+
+    source = await keyset_source(gdb, "Orgs", "points", 5, render, "name, points, rep")
+    if source:
+        message = await ctx.send(embed=await source.get(0))
+        page = Paginator(bot, message, use_more=False, source=source)
+        await page.start()
+    else:
+        embed = discord.Embed(title=f"Список гильдий для этого сервера пуст :(", color=discord.Colour.from_rgb(254, 254, 254))
+        embed.set_image(url="https://media1.tenor.com/images/a00ad898a26dbb80abb5cd3fc846fa4e/tenor.gif?itemid=16025185")
+        await ctx.send(embed=embed)
 
 
 @bot.command(name="give_money", aliases=["add_money", "addcoin"],
@@ -322,21 +470,15 @@ async def profile(ctx, *args):
 async def give_money(ctx, member_tag, amount):
     amount = to_float_or_int(amount)
 
-    gdb = guild_databases[ctx.message.guild.id]
+    gdb = await guild_databases.get(ctx.message.guild.id)
     if ctx.message.mentions:
         member = ctx.message.mentions[0]
     else:
         await ctx.send(f"Вам необходиом отметить пользователя!")
         return
-    user_data = gdb.read("Members", "id", member.id)
-
-    if not user_data:
-        create_user(gdb, member.id, member.name, amount)
-        await ctx.send(f"{member.mention} now has {amount} coins! (+{amount})")
-    else:
-        now_money = to_float_or_int(user_data[2] + amount)
-        gdb.update("Members", "id", member.id, "money", now_money)
-        await ctx.send(f"{member.mention} now has {now_money} coins! (+{amount})")
+    now_money = await gdb.increment("Members", "id", member.id, "money", amount, insert_values={"tag": member.name})
+    now_money = to_float_or_int(now_money + accrual.pending(ctx.guild.id, member.id))
+    await ctx.send(f"{member.mention} now has {now_money} coins! (+{amount})")
 
 
 @bot.command(name="take_money", aliases=["takecoin"],
@@ -346,25 +488,22 @@ async def give_money(ctx, member_tag, amount):
 async def take_money(ctx, member_tag, amount):
     amount = to_float_or_int(amount)
 
-    gdb = guild_databases[ctx.message.guild.id]
+    gdb = await guild_databases.get(ctx.message.guild.id)
     if ctx.message.mentions:
         member = ctx.message.mentions[0]
     else:
         await ctx.send(f"Вам необходиом отметить пользователя!")
         return
-    user_data = gdb.read("Members", "id", member.id)
+    await accrual.flush_member(ctx.guild.id, member.id, gdb)
+    now_money = await gdb.debit("Members", "id", member.id, "money", amount)
 
-    if not user_data:
-        create_user(gdb, member.id, member.name)
+    if now_money is not None:
+        await ctx.send(f"{member.mention} now has {to_float_or_int(now_money)} coins! (-{amount})")
+    elif not await gdb.read("Members", "id", member.id):
+        await create_user(gdb, member.id, member.name)
         await ctx.send(f"{member.mention} now has 0 coins! (-0)")
     else:
-        if (user_data[2] - amount) < 0:
-            await ctx.send(f"{member.mention} has less coins that you try to take!")
-            return
-
-        now_money = to_float_or_int(user_data[2] - amount)
-        gdb.update("Members", "id", member.id, "money", now_money)
-        await ctx.send(f"{member.mention} now has {now_money} coins! (-{amount})")
+        await ctx.send(f"{member.mention} has less coins that you try to take!")
 
 
 @bot.command(name="set_money", aliases=["setcoin"],
@@ -374,21 +513,136 @@ async def take_money(ctx, member_tag, amount):
 async def set_money(ctx, member_tag, amount):
     amount = to_float_or_int(amount)
 
-    gdb = guild_databases[ctx.message.guild.id]
+    gdb = await guild_databases.get(ctx.message.guild.id)
 
     if ctx.message.mentions:
         member = ctx.message.mentions[0]
     else:
         await ctx.send(f"Вам необходиом отметить пользователя!")
         return
-    user_data = gdb.read("Members", "id", member.id)
+    await accrual.flush_member(ctx.guild.id, member.id, gdb)
+    await gdb.upsert("Members", "id", {"id": member.id, "tag": member.name, "money": amount}, update_columns=["money"])
 
-    if not user_data:
-        create_user(gdb, member.id, member.name, amount)
+    await ctx.send(f"{member.mention}'s money now set on {amount} coins!")
+
+
+async def bulk_targets(ctx, gdb, targets):
+    """
+    :param targets: Command arguments after the amount: member and role mentions and/or an org name
+    :return: Dict of {member id: name} of mentioned members, members of mentioned roles and members of the org
+    """
+    members = {member.id: member.name for member in ctx.message.mentions if not member.bot}
+    for role in ctx.message.role_mentions:
+        members.update((member.id, member.name) for member in role.members if not member.bot)
+    org_name = " ".join(word for word in targets.split() if not word.startswith("<@"))
+    if org_name:
+        for member_id, tag in await gdb.read_all_by("Members", "organization", org_name, "id, tag") or ():
+            members.setdefault(member_id, tag)
+    return members
+
+
+@bot.command(name="give_money_bulk", aliases=["addcoins"],
+             usage="[amount] [user/role mentions or guild_name]",
+             help="Добавляет монеты всем отмеченным участникам, участникам ролей или гильдии")
+@commands.guild_only()
+@commands.check(check_admin)
+async def give_money_bulk(ctx, amount: to_float_or_int, *, targets):
+    gdb = await guild_databases.get(ctx.message.guild.id)
+    members = await bulk_targets(ctx, gdb, targets)
+    if not members:
+        await ctx.send(f"Вам необходиом отметить пользователей, роли или указать гильдию!")
+        return
+    if not await gdb.increment_many("Members", "id", "money",
+                                    [(member_id, amount, tag) for member_id, tag in members.items()], ("tag",)):
+        await ctx.send("Не удалось начислить монеты, попробуйте еще раз")
+        return
+    await ctx.send(f"{len(members)} members got {amount} coins! (+{amount * len(members)} total)")
+
+
+@bot.command(name="take_money_bulk", aliases=["takecoins"],
+             usage="[amount] [user/role mentions or guild_name]",
+             help="Отбирает монеты у всех отмеченных участников, участников ролей или гильдии")
+@commands.guild_only()
+@commands.check(check_admin)
+async def take_money_bulk(ctx, amount: to_float_or_int, *, targets):
+    gdb = await guild_databases.get(ctx.message.guild.id)
+    members = await bulk_targets(ctx, gdb, targets)
+    if not members:
+        await ctx.send(f"Вам необходиом отметить пользователей, роли или указать гильдию!")
+        return
+    await accrual.flush_guild(ctx.guild.id, gdb)
+    taken = await gdb.debit_many("Members", "id", "money", [(member_id, amount) for member_id in members])
+    if taken is None:
+        await ctx.send("Не удалось отобрать монеты, попробуйте еще раз")
+        return
+    await ctx.send(f"Took {amount} coins from {taken} of {len(members)} members! "
+                   f"({len(members) - taken} have less coins or no account)")
+
+
+@bot.command(name="set_money_bulk", aliases=["setcoins"],
+             usage="[amount] [user/role mentions or guild_name]",
+             help="Устанавливает счет всех отмеченных участников, участников ролей или гильдии")
+@commands.guild_only()
+@commands.check(check_admin)
+async def set_money_bulk(ctx, amount: to_float_or_int, *, targets):
+    gdb = await guild_databases.get(ctx.message.guild.id)
+    members = await bulk_targets(ctx, gdb, targets)
+    if not members:
+        await ctx.send(f"Вам необходиом отметить пользователей, роли или указать гильдию!")
+        return
+    await accrual.flush_guild(ctx.guild.id, gdb)
+    if not await gdb.upsert_many("Members", "id", ("id", "tag", "money"),
+                                 [(member_id, tag, amount) for member_id, tag in members.items()], ["money"]):
+        await ctx.send("Не удалось установить счет, попробуйте еще раз")
+        return
+    await ctx.send(f"Money of {len(members)} members now set on {amount} coins!")
+
+
+@bot.command(name="ledger", usage="[user mention or guild_name]",
+             help="Показывает последние записи журнала операций участника или гильдии")
+@commands.guild_only()
+@commands.check(check_admin)
+async def ledger_history(ctx, *, org_name=None):
+    gdb = await guild_databases.get(ctx.message.guild.id)
+    if org_name and not ctx.message.mentions:
+        org_data = await gdb.read("Orgs", "name", org_name)
+        if not org_data:
+            await ctx.send(f"Гильдии с именем {org_name} не существует!")
+            return
+        owner, title = org_data[0], org_data[1]
     else:
-        gdb.update("Members", "id", member.id, "money", amount)
+        member = ctx.message.mentions[0] if ctx.message.mentions else ctx.author
+        await accrual.flush_member(ctx.guild.id, member.id, gdb)  # buffered rewards aren't in the ledger yet
+        owner, title = member.id, member.name
 
-    await ctx.send(f"{member.mention}'s money now set on {amount} coins!")
+    entries = await ledger.history(gdb, owner)
+    if not entries:
+        await ctx.send(f"Журнал операций {title} пуст")
+        return
+    accounts = {"Members.money": ":coin:", "Orgs.points": ":low_brightness:", "Orgs.rep": ":military_medal:"}
+    embed = discord.Embed(title=f"**Журнал операций**\n{title}", color=discord.Colour.from_rgb(254, 254, 254))
+    for entry_id, account, amount, created in entries:
+        embed.add_field(name=f"#{entry_id} • {time.strftime('%d.%m.%Y %H:%M', time.localtime(created))}",
+                        value=f"{accounts.get(account, account)} {to_signed(amount)}",
+                        inline=False)
+    embed.set_footer(text="rebuild_balances [entry id] откатывает записи после указанной")
+    await ctx.send(embed=embed)
+
+
+@bot.command(name="rebuild_balances", usage="[entry id]",
+             help="Пересчитывает монеты, очки и репутацию по журналу операций, откатывая записи после указанной")
+@commands.guild_only()
+@commands.check(check_admin)
+async def rebuild_balances(ctx, until: int = None):
+    gdb = await guild_databases.get(ctx.message.guild.id)
+    await accrual.flush_guild(ctx.guild.id, gdb)
+    rebuilt = await ledger.rebuild(gdb, ctx.guild.id, until)
+    if rebuilt:
+        await ctx.send("Балансы пересчитаны по журналу операций" + (f" до записи {until}" if until else ""))
+    elif rebuilt is None:
+        await ctx.send(f"Записи после {until} уже свёрнуты в снимки, откатить к ней нельзя")
+    else:
+        await ctx.send("Не удалось пересчитать балансы")
 
 
 @bot.command(name="add_role_shop", aliases=["addrole", "addshop"],
@@ -396,9 +650,10 @@ async def set_money(ctx, member_tag, amount):
 @commands.guild_only()
 @commands.check(check_admin)
 async def add_role_shop(ctx, role: discord.Role, price: to_float_or_int):
-    gdb = guild_databases[ctx.message.guild.id]
-    if not gdb.read("Shop", "id", role.id):
-        gdb.insert("Shop", values=f"{role.id}, {price}")
+    gdb = await guild_databases.get(ctx.message.guild.id)
+    if not await gdb.read("Shop", "id", role.id):
+        await gdb.insert("Shop", values=(role.id, price))
+        shop_catalog.invalidate(ctx.guild.id)
         await ctx.send(f"Роль {role.mention} успешно добавлена в магазин! Цена: {price} монет")
     else:
         await ctx.send(f"Роль {role.mention} уже добавлена в магазин!")
@@ -409,9 +664,10 @@ async def add_role_shop(ctx, role: discord.Role, price: to_float_or_int):
 @commands.guild_only()
 @commands.check(check_admin)
 async def edit_price(ctx, role: discord.Role, price: to_float_or_int):
-    gdb = guild_databases[ctx.message.guild.id]
-    if gdb.read("Shop", "id", role.id):
-        gdb.update("Shop", "id", role.id, "price", price)
+    gdb = await guild_databases.get(ctx.message.guild.id)
+    if await gdb.read("Shop", "id", role.id):
+        await gdb.update("Shop", "id", role.id, "price", price)
+        shop_catalog.invalidate(ctx.guild.id)
         await ctx.send(f"Теперь {role.mention} стоит {price} монет!")
     else:
         await ctx.send(f"Роль {role.mention} не добавлена в магазин!")
@@ -422,9 +678,10 @@ async def edit_price(ctx, role: discord.Role, price: to_float_or_int):
 @commands.guild_only()
 @commands.check(check_admin)
 async def remove_role_shop(ctx, role: discord.Role):
-    gdb = guild_databases[ctx.message.guild.id]
-    if gdb.read("Shop", "id", role.id):
-        gdb.delete("Shop", "id", role.id)
+    gdb = await guild_databases.get(ctx.message.guild.id)
+    if await gdb.read("Shop", "id", role.id):
+        await gdb.delete("Shop", "id", role.id)
+        shop_catalog.invalidate(ctx.guild.id)
         await ctx.send(f"Роль {role.mention} больше на продается в магазине!")
     else:
         await ctx.send(f"Роль {role.mention} не добавлена в магазин!")
@@ -433,27 +690,19 @@ async def remove_role_shop(ctx, role: discord.Role):
 @bot.command(name="shop", help="Магазин ролей")
 @commands.guild_only()
 async def shop(ctx):
-    gdb = guild_databases[ctx.message.guild.id]
-    roles_data_list = gdb.read_all_by_order("Shop", "price")
-    if roles_data_list:
-        embeds = []
-        embed = discord.Embed(title=f":sparkles: __Магазин ролей__ :sparkles:", color=discord.Colour.from_rgb(254, 254, 254))
-        embed_counter = 1
-        for role in roles_data_list:
-            role_obj = ctx.guild.get_role(role[0])
-            if role_obj:
-                embed.add_field(name=f"Цена: {role[1]} :coin:", value=role_obj.mention, inline=False)
-                if embed_counter % 6 == 0:
-                    embeds.append(embed)
-                    embed = discord.Embed(title=f":sparkles: __Магазин ролей__ :sparkles:", color=discord.Colour.from_rgb(254, 254, 254))
-                embed_counter += 1
-        if (embed_counter - 1) % 6 != 0 and embed.fields:
-            embeds.append(embed)
-        if embeds:
-            message = await ctx.send(embed=embeds[0])
-            page = Paginator(bot, message, use_more=False, embeds=embeds)
-            await page.start()
-            return
+    pages = await shop_catalog.pages(ctx.guild)
+    if pages:
+        async def render(index):
+            embed = discord.Embed(title=f":sparkles: __Магазин ролей__ :sparkles:", color=discord.Colour.from_rgb(254, 254, 254))
+            for mention, price in pages[index]:
+                embed.add_field(name=f"Цена: {price} :coin:", value=mention, inline=False)
+            return embed
+
+        source = PageSource(len(pages), render)
+        message = await ctx.send(embed=await source.get(0))
+        page = Paginator(bot, message, use_more=False, source=source)
+        await page.start()
+        return
     embed = discord.Embed(title=f"Магазин ролей пуст :(", color=discord.Colour.from_rgb(254, 254, 254))
     embed.set_image(url="https://media1.tenor.com/images/a00ad898a26dbb80abb5cd3fc846fa4e/tenor.gif?itemid=16025185")
     await ctx.send(embed=embed)
@@ -463,26 +712,39 @@ async def shop(ctx):
              usage="[role mention]", help="Купить роль из магазина")
 @commands.guild_only()
 async def buy(ctx, role: discord.Role):
-    gdb = guild_databases[ctx.message.guild.id]
-    role_data = gdb.read("Shop", "id", role.id)
+    gdb = await guild_databases.get(ctx.message.guild.id)
+    role_data = await gdb.read("Shop", "id", role.id)
     if role_data:
         role_obj = ctx.guild.get_role(role_data[0])
         if role_obj:
-            if role_obj not in ctx.author.roles:
-                user_data = gdb.read("Members", "id", ctx.author.id)
-                if not user_data:
-                    create_user(gdb, ctx.author.id, ctx.author.name)
-                if user_data[2] >= role_data[1]:
-                    await ctx.author.add_roles(role_obj)
-                    gdb.update("Members", "id", ctx.author.id, "money", user_data[2]-role_data[1])
-                    embed = discord.Embed(title=f"Роль теперь ваша! UwU", color=discord.Colour.from_rgb(254, 254, 254))
-                    embed.set_image(url="https://media1.tenor.com/images/d5da5398e5a193120690d0f0ca64d2ed/tenor.gif")
-                    await ctx.send(embed=embed)
-                    return
+            async with member_locks.hold((ctx.guild.id, ctx.author.id)):  # one purchase of a member at a time
+                try:  # the cached member gets roles of an earlier purchase only with a later gateway event
+                    member = await ctx.guild.fetch_member(ctx.author.id)
+                except discord.HTTPException as e:
+                    log.error(f"Can't fetch {ctx.author} before a purchase: {e}")
+                    member = None
+                if member is None:
+                    embed_text = "Не получилось проверить ваши роли, попробуйте позже"
+                elif role_obj not in member.roles:
+                    await accrual.flush_member(ctx.guild.id, ctx.author.id, gdb)
+                    if not await gdb.read("Members", "id", ctx.author.id):
+                        await create_user(gdb, ctx.author.id, ctx.author.name)
+                    if await gdb.debit("Members", "id", ctx.author.id, "money", role_data[1]) is not None:
+                        try:
+                            await ctx.author.add_roles(role_obj)
+                        except discord.HTTPException as e:
+                            await gdb.increment("Members", "id", ctx.author.id, "money", role_data[1])  # refund
+                            log.error(f"Refunded {role_data[1]} to {ctx.author} after failed add_roles: {e}")
+                            embed_text = "Не получилось выдать роль, монеты возвращены"
+                        else:
+                            embed = discord.Embed(title=f"Роль теперь ваша! UwU", color=discord.Colour.from_rgb(254, 254, 254))
+                            embed.set_image(url="https://media1.tenor.com/images/d5da5398e5a193120690d0f0ca64d2ed/tenor.gif")
+                            await ctx.send(embed=embed)
+                            return
+                    else:
+                        embed_text = "Эта роль стоит слишком дорого :("
                 else:
-                    embed_text = "Эта роль стоит слишком дорого :("
-            else:
-                embed_text = "У вас уже есть эта роль"
+                    embed_text = "У вас уже есть эта роль"
         else:
             embed_text = "С этой ролью что-то не так..."
     else:
@@ -497,9 +759,9 @@ async def buy(ctx, role: discord.Role):
 @commands.guild_only()
 @commands.check(check_admin)
 async def create_guild(ctx, *, name):
-    gdb = guild_databases[ctx.message.guild.id]
-    if not gdb.read("Orgs", "name", f"'{name}'"):
-        gdb.insert("Orgs", columns="name, points, rep", values=f"'{name}', 0, 0")
+    gdb = await guild_databases.get(ctx.message.guild.id)
+    if not await gdb.read("Orgs", "name", name):
+        await gdb.insert("Orgs", columns="name, points, rep", values=(name, 0, 0))
         await ctx.send(f"Гильдия {name} успешно создана!")
     else:
         await ctx.send(f"Гильдия с именем {name} уже есть на сервере!")
@@ -510,36 +772,43 @@ async def create_guild(ctx, *, name):
 @commands.guild_only()
 @commands.check(check_admin)
 async def edit_guild_name(ctx, org_name, new_name):
-    gdb = guild_databases[ctx.message.guild.id]
-    if gdb.read("Orgs", "name", f"'{org_name}'"):
-        gdb.update("Orgs", "name", f"'{org_name}'", "name", f"'{new_name}'")
+    gdb = await guild_databases.get(ctx.message.guild.id)
+    if await gdb.read("Orgs", "name", org_name):
+        await gdb.update("Orgs", "name", org_name, "name", new_name)
         await ctx.send(f"Название гильдии {org_name} изменено на {new_name}!")
     else:
         await ctx.send(f"Гильдии с именем {org_name} не существует!")
 
 
+async def org_score_args(ctx, args):
+    """
+    :param args: "[name] [amount]" command arguments, name may contain spaces
+    :return: (org name, amount) or None after telling the user the arguments are wrong
+    """
+    if len(args) > 1:
+        try:
+            return " ".join(args[:-1]), to_float_or_int(args[-1])
+        except ValueError:
+            pass
+    await ctx.send("Введены не все аргументы. Проверьте правильносьт введенной комманды")
+    log.error(f"Raised error on message ({ctx.message.content}) by {ctx.message.author}: Введены не все аргументы.")
+    return None
+
+
 @bot.command(name="give_guild_points", aliases=["givepoints", "addpoints"],
              usage="[name] [amount]", help="Добавляет указанное кол-во очков гильдии")
 @commands.guild_only()
 @commands.check(check_admin)
 async def give_guild_points(ctx, *args):
-    if len(args) > 1:
-        try:
-            amount = to_float_or_int(args[-1])
-        except ValueError:
-            await ctx.send("Введены не все аргументы. Проверьте правильносьт введенной комманды")
-            return
-        org_name = " ".join(args[:-1])
-        gdb = guild_databases[ctx.message.guild.id]
-        org_data = gdb.read("Orgs", "name", f"'{org_name}'")
-        if org_data:
-            gdb.update("Orgs", "name", f"'{org_name}'", "points", to_float_or_int(org_data[2]+amount))
-            await ctx.send(f"Гильдия {org_name} теперь имеет {to_float_or_int(org_data[2]+amount)} очков! (+{amount})")
+    parsed = await org_score_args(ctx, args)
+    if parsed:
+        org_name, amount = parsed
+        gdb = await guild_databases.get(ctx.message.guild.id)
+        now = await gdb.increment("Orgs", "name", org_name, "points", amount)
+        if now is not None:
+            await ctx.send(f"Гильдия {org_name} теперь имеет {to_float_or_int(now)} очков! (+{amount})")
         else:
             await ctx.send(f"Гильдии с именем {org_name} не существует!")
-    else:
-        await ctx.send("Введены не все аргументы. Проверьте правильносьт введенной комманды")
-        log.error(f"Raised error on message ({ctx.message.content}) by {ctx.message.author}: Введены не все аргументы.")
 
 
 @bot.command(name="take_guild_points", aliases=["rempoints", "takepoints"],
@@ -547,27 +816,18 @@ async def give_guild_points(ctx, *args):
 @commands.guild_only()
 @commands.check(check_admin)
 async def take_guild_points(ctx, *args):
-    if len(args) > 1:
-        try:
-            amount = to_float_or_int(args[-1])
-        except ValueError:
-            await ctx.send("Введены не все аргументы. Проверьте правильносьт введенной комманды")
-            return
-        org_name = " ".join(args[:-1])
-        gdb = guild_databases[ctx.message.guild.id]
-        org_data = gdb.read("Orgs", "name", f"'{org_name}'")
-        if org_data:
-            if org_data[2]-amount >= 0:
-                gdb.update("Orgs", "name", f"'{org_name}'", "points", to_float_or_int(org_data[2]-amount))
-                await ctx.send(f"Гильдия {org_name} теперь имеет {to_float_or_int(org_data[2]-amount)} очков! (-{amount})")
-            else:
-                gdb.update("Orgs", "name", f"'{org_name}'", "points", 0)
-                await ctx.send(f"Гильдия {org_name} теперь имеет 0 очков! (-{org_data[2]})")
+    parsed = await org_score_args(ctx, args)
+    if parsed:
+        org_name, amount = parsed
+        gdb = await guild_databases.get(ctx.message.guild.id)
+        results = await gdb.increment_pairs("Orgs", "name", "points", [(org_name, -amount)], minimum=0)
+        if results is None:
+            await ctx.send("Не удалось отнять очки, попробуйте еще раз")
+        elif results[org_name] is not None:  # the change is smaller than amount if the points hit zero
+            now, change = results[org_name]
+            await ctx.send(f"Гильдия {org_name} теперь имеет {to_float_or_int(now)} очков! ({to_signed(change)})")
         else:
             await ctx.send(f"Гильдии с именем {org_name} не существует!")
-    else:
-        await ctx.send("Введены не все аргументы. Проверьте правильносьт введенной комманды")
-        log.error(f"Raised error on message ({ctx.message.content}) by {ctx.message.author}: Введены не все аргументы.")
 
 
 @bot.command(name="set_guild_points", aliases=["setpoints"],
@@ -575,23 +835,43 @@ async def take_guild_points(ctx, *args):
 @commands.guild_only()
 @commands.check(check_admin)
 async def set_guild_points(ctx, *args):
-    if len(args) > 1:
-        try:
-            amount = to_float_or_int(args[-1])
-        except ValueError:
-            await ctx.send("Введены не все аргументы. Проверьте правильносьт введенной комманды")
-            return
-        org_name = " ".join(args[:-1])
-        gdb = guild_databases[ctx.message.guild.id]
-        org_data = gdb.read("Orgs", "name", f"'{org_name}'")
-        if org_data:
-            gdb.update("Orgs", "name", f"'{org_name}'", "points", amount)
+    parsed = await org_score_args(ctx, args)
+    if parsed:
+        org_name, amount = parsed
+        gdb = await guild_databases.get(ctx.message.guild.id)
+        if await gdb.update("Orgs", "name", org_name, "points", amount):
             await ctx.send(f"Гильдия {org_name} теперь имеет {amount} очков!")
         else:
             await ctx.send(f"Гильдии с именем {org_name} не существует!")
-    else:
-        await ctx.send("Введены не все аргументы. Проверьте правильносьт введенной комманды")
-        log.error(f"Raised error on message ({ctx.message.content}) by {ctx.message.author}: Введены не все аргументы.")
+
+
+@bot.command(name="give_guilds_points", aliases=["eventpoints"],
+             usage="[name] [amount]; [name] [amount]...", help="Начисляет или отнимает очки нескольких гильдий сразу")
+@commands.guild_only()
+@commands.check(check_admin)
+async def give_guilds_points(ctx, *, scores):
+    pairs = []
+    for score in filter(str.strip, scores.split(";")):
+        parsed = await org_score_args(ctx, score.split())
+        if not parsed:
+            return
+        pairs.append(parsed)
+    if len({org_name for org_name, _ in pairs}) < len(pairs):
+        await ctx.send("Каждую гильдию можно указать только один раз")
+        return
+    gdb = await guild_databases.get(ctx.message.guild.id)
+    results = await gdb.increment_pairs("Orgs", "name", "points", pairs, minimum=0)
+    if results is None:
+        await ctx.send("Не удалось начислить очки, попробуйте еще раз")
+        return
+    lines = []
+    for org_name, _ in pairs:
+        if results[org_name] is not None:
+            now, change = results[org_name]
+            lines.append(f"{org_name}: {to_float_or_int(now)} очков ({to_signed(change)})")
+        else:
+            lines.append(f"{org_name}: гильдии не существует")
+    await ctx.send("\n".join(lines))
 
 
 @bot.command(name="give_guild_rep", aliases=["giverep", "addrep"],
@@ -599,23 +879,15 @@ async def set_guild_points(ctx, *args):
 @commands.guild_only()
 @commands.check(check_admin)
 async def give_guild_rep(ctx, *args):
-    if len(args) > 1:
-        try:
-            amount = to_float_or_int(args[-1])
-        except ValueError:
-            await ctx.send("Введены не все аргументы. Проверьте правильносьт введенной комманды")
-            return
-        org_name = " ".join(args[:-1])
-        gdb = guild_databases[ctx.message.guild.id]
-        org_data = gdb.read("Orgs", "name", f"'{org_name}'")
-        if org_data:
-            gdb.update("Orgs", "name", f"'{org_name}'", "rep", to_float_or_int(org_data[3]+amount))
-            await ctx.send(f"Гильдия {org_name} теперь имеет {to_float_or_int(org_data[3]+amount)} очков репутации! (+{amount})")
+    parsed = await org_score_args(ctx, args)
+    if parsed:
+        org_name, amount = parsed
+        gdb = await guild_databases.get(ctx.message.guild.id)
+        now = await gdb.increment("Orgs", "name", org_name, "rep", amount)
+        if now is not None:
+            await ctx.send(f"Гильдия {org_name} теперь имеет {to_float_or_int(now)} очков репутации! (+{amount})")
         else:
             await ctx.send(f"Гильдии с именем {org_name} не существует!")
-    else:
-        await ctx.send("Введены не все аргументы. Проверьте правильносьт введенной комманды")
-        log.error(f"Raised error on message ({ctx.message.content}) by {ctx.message.author}: Введены не все аргументы.")
 
 
 @bot.command(name="take_guild_rep", aliases=["takerep"],
@@ -623,27 +895,18 @@ async def give_guild_rep(ctx, *args):
 @commands.guild_only()
 @commands.check(check_admin)
 async def take_guild_rep(ctx, *args):
-    if len(args) > 1:
-        try:
-            amount = to_float_or_int(args[-1])
-        except ValueError:
-            await ctx.send("Введены не все аргументы. Проверьте правильносьт введенной комманды")
-            return
-        org_name = " ".join(args[:-1])
-        gdb = guild_databases[ctx.message.guild.id]
-        org_data = gdb.read("Orgs", "name", f"'{org_name}'")
-        if org_data:
-            if org_data[2]-amount >= 0:
-                gdb.update("Orgs", "name", f"'{org_name}'", "rep", to_float_or_int(org_data[3]-amount))
-                await ctx.send(f"Гильдия {org_name} теперь имеет {to_float_or_int(org_data[3]-amount)} очков репутации! (-{amount})")
-            else:
-                gdb.update("Orgs", "name", f"'{org_name}'", "rep", 0)
-                await ctx.send(f"Гильдия {org_name} теперь имеет 0 очков репутации! (-{org_data[3]})")
+    parsed = await org_score_args(ctx, args)
+    if parsed:
+        org_name, amount = parsed
+        gdb = await guild_databases.get(ctx.message.guild.id)
+        results = await gdb.increment_pairs("Orgs", "name", "rep", [(org_name, -amount)], minimum=0)
+        if results is None:
+            await ctx.send("Не удалось отнять репутацию, попробуйте еще раз")
+        elif results[org_name] is not None:  # the change is smaller than amount if the rep hit zero
+            now, change = results[org_name]
+            await ctx.send(f"Гильдия {org_name} теперь имеет {to_float_or_int(now)} очков репутации! ({to_signed(change)})")
         else:
             await ctx.send(f"Гильдии с именем {org_name} не существует!")
-    else:
-        await ctx.send("Введены не все аргументы. Проверьте правильносьт введенной комманды")
-        log.error(f"Raised error on message ({ctx.message.content}) by {ctx.message.author}: Введены не все аргументы.")
 
 
 @bot.command(name="set_guild_rep", aliases=["setrep"],
@@ -651,23 +914,14 @@ async def take_guild_rep(ctx, *args):
 @commands.guild_only()
 @commands.check(check_admin)
 async def set_guild_rep(ctx, *args):
-    if len(args) > 1:
-        try:
-            amount = to_float_or_int(args[-1])
-        except ValueError:
-            await ctx.send("Введены не все аргументы. Проверьте правильносьт введенной комманды")
-            return
-        org_name = " ".join(args[:-1])
-        gdb = guild_databases[ctx.message.guild.id]
-        org_data = gdb.read("Orgs", "name", f"'{org_name}'")
-        if org_data:
-            gdb.update("Orgs", "name", f"'{org_name}'", "rep", amount)
+    parsed = await org_score_args(ctx, args)
+    if parsed:
+        org_name, amount = parsed
+        gdb = await guild_databases.get(ctx.message.guild.id)
+        if await gdb.update("Orgs", "name", org_name, "rep", amount):
             await ctx.send(f"Гильдия {org_name} теперь имеет {amount} очков репутации!")
         else:
             await ctx.send(f"Гильдии с именем {org_name} не существует!")
-    else:
-        await ctx.send("Введены не все аргументы. Проверьте правильносьт введенной комманды")
-        log.error(f"Raised error on message ({ctx.message.content}) by {ctx.message.author}: Введены не все аргументы.")
 
 
 @bot.command(name="ping", help="Показывает задержку отправки собщений")
@@ -679,31 +933,7 @@ async def ping(ctx):
 
 @bot.command(name='help', help="Показать это сообщение")
 async def help(ctx):
-    prefix = default_prefixes[0]
-    if ctx.guild:
-        if ctx.guild.id in custom_prefixes:
-            prefix = custom_prefixes[ctx.guild.id]
-
-    embeds = []
-    embed = discord.Embed(title=f"**Команды Ulvication:**",
-                          color=discord.Colour.from_rgb(254, 254, 254))
-    embed_counter = 1
-
-    for command in bot.commands:
-        if check_admin not in command.checks:
-            command_string = f"{prefix}{command.name}"
-            command_string += " | " + " | ".join(command.aliases) if command.aliases else ""
-            command_string += f" {command.usage}" if command.usage else ""
-            command_string += f"  - {command.help}"
-            embed.add_field(name=command_string, value=f" ‌‌‍‍", inline=False)
-            if embed_counter % 10 == 0:
-                embeds.append(embed)
-                embed = discord.Embed(title=f"**Команды**",
-                                      color=discord.Colour.from_rgb(254, 254, 254))
-            embed_counter += 1
-
-    if (embed_counter - 1) % 10 != 0:
-        embeds.append(embed)
+    embeds = help_catalog.pages(guild_prefix(ctx.guild))
     await ctx.send(embed=embeds[0])
     # message = await ctx.send(embed=embeds[0])
     # page = Paginator(bot, message, use_more=False, embeds=embeds)
@@ -714,30 +944,7 @@ async def help(ctx):
 @commands.guild_only()
 @commands.check(check_admin)
 async def admin_help(ctx):
-    prefix = default_prefixes[0]
-    if ctx.guild.id in custom_prefixes:
-        prefix = custom_prefixes[ctx.guild.id]
-
-    embeds = []
-    embed = discord.Embed(title=f"**Команды Ulvication:**",
-                          color=discord.Colour.from_rgb(254, 254, 254))
-    embed_counter = 1
-
-    for command in bot.commands:
-        if check_admin in command.checks:
-            command_string = f"{prefix}{command.name}"
-            command_string += " | " + " | ".join(command.aliases) if command.aliases else ""
-            command_string += f" {command.usage}" if command.usage else ""
-            command_string += f"  - {command.help}"
-            embed.add_field(name=command_string, value=f" ‌‌‍‍", inline=False)
-            if embed_counter % 10 == 0:
-                embeds.append(embed)
-                embed = discord.Embed(title=f"**Команды**",
-                                      color=discord.Colour.from_rgb(254, 254, 254))
-            embed_counter += 1
-
-    if (embed_counter - 1) % 10 != 0:
-        embeds.append(embed)
+    embeds = help_catalog.pages(guild_prefix(ctx.guild), admin=True)
     message = await ctx.send(embed=embeds[0])
     page = Paginator(bot, message, use_more=False, embeds=embeds)
     await page.start()
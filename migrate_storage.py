@@ -0,0 +1,109 @@
+# Copyright 2020 Артём Воронов
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Offline migration of per-guild databases (data/databases/<guild id>.db) into shared_db_path.
+# Stop the bot, run "python migrate_storage.py", then set guild_storage = "shared" in settings.py.
+# Rows are copied by SQLite itself (INSERT ... SELECT from attached file), one transaction per guild,
+# so memory use doesn't depend on guild size. Rows already present in the shared database are kept,
+# ledger history is copied along with the rows it belongs to.
+import os
+import sqlite3
+import time
+from modules.baselogger import get_logger
+from modules.database import DataBase
+from modules.schema import SHARED_GUILD_MIGRATIONS, LEDGER_ACCOUNTS
+from settings import shared_db_path
+log = get_logger("migrate")
+
+GUILDS_DIR = "data/databases"
+COPY_TABLES = [
+    """INSERT OR IGNORE INTO Members (id, tag, money, organization, guild_id)
+       SELECT id, tag, money, organization, ? FROM guild.Members;""",
+    """INSERT OR IGNORE INTO Orgs (name, points, rep, guild_id)
+       SELECT name, points, rep, ? FROM guild.Orgs ORDER BY id;""",
+    """INSERT OR IGNORE INTO Shop (id, price, guild_id)
+       SELECT id, price, ? FROM guild.Shop;""",
+]
+
+# Ledger history is copied only for rows inserted by COPY_TABLES, their insert triggers seeded them with ids in
+# (?2, ?3]. The seeds are replaced by the history, snapshots get entry ?3, so copied entries stay rollbackable.
+# Orgs get new ids in the shared database, so owners are matched by name. ?1 is guild id
+OWNER_KEYS = {"Members": "id", "Orgs": "name"}
+OWNERS = " UNION ALL ".join(
+    f"""SELECT '{table}.{column}', old.id, new.id FROM guild.{table} old
+        JOIN main.{table} new ON new.guild_id = ?1 AND new.{OWNER_KEYS[table]} = old.{OWNER_KEYS[table]}"""
+    for table, column in LEDGER_ACCOUNTS)
+SEEDED = """EXISTS (SELECT 1 FROM main.Ledger seed WHERE seed.id > ?2 AND seed.id <= ?3 AND seed.guild_id = ?1
+                   AND seed.account = owners.account AND seed.owner = owners.new)"""
+COPY_LEDGER = [
+    f"""WITH owners (account, old, new) AS ({OWNERS})
+        INSERT INTO LedgerSnapshots (account, owner, balance, entry, guild_id)
+        SELECT snapshot.account, owners.new, snapshot.balance, ?3, ?1 FROM guild.LedgerSnapshots snapshot
+        JOIN owners ON owners.account = snapshot.account AND owners.old = snapshot.owner WHERE {SEEDED};""",
+    f"""WITH owners (account, old, new) AS ({OWNERS})
+        INSERT INTO Ledger (account, owner, amount, created, guild_id)
+        SELECT entry.account, owners.new, entry.amount, entry.created, ?1 FROM guild.Ledger entry
+        JOIN owners ON owners.account = entry.account AND owners.old = entry.owner WHERE {SEEDED}
+        ORDER BY entry.id;""",
+    """DELETE FROM Ledger WHERE id > ?2 AND id <= ?3 AND guild_id = ?1 AND (
+           EXISTS (SELECT 1 FROM LedgerSnapshots snapshot WHERE snapshot.guild_id = ?1 AND snapshot.entry = ?3
+                   AND snapshot.account = Ledger.account AND snapshot.owner = Ledger.owner)
+           OR EXISTS (SELECT 1 FROM Ledger copied WHERE copied.id > ?3 AND copied.guild_id = ?1
+                      AND copied.account = Ledger.account AND copied.owner = Ledger.owner));""",
+]
+
+
+def guild_files():
+    for file_name in sorted(os.listdir(GUILDS_DIR)):
+        guild_id, extension = os.path.splitext(file_name)
+        if extension == ".db" and guild_id.isdigit():
+            yield int(guild_id), os.path.join(GUILDS_DIR, file_name)
+
+
+def migrate():
+    shared_db = DataBase(shared_db_path)
+    shared_db.migrate(SHARED_GUILD_MIGRATIONS)
+    shared_db.close()
+
+    conn = sqlite3.connect(shared_db_path, isolation_level=None)  # transactions are managed below
+    started = time.perf_counter()
+    migrated = 0
+    for guild_id, path in guild_files():
+        conn.execute("ATTACH DATABASE ? AS guild;", (path,))
+        try:
+            tables = {row[0] for row in conn.execute("SELECT name FROM guild.sqlite_master WHERE type = 'table';")}
+            conn.execute("BEGIN;")
+            last_entry = conn.execute("SELECT COALESCE(MAX(id), 0) FROM Ledger;").fetchone()[0]
+            for table, sql in zip(["Members", "Orgs", "Shop"], COPY_TABLES):
+                if table in tables:
+                    conn.execute(sql, (guild_id,))
+            if "Ledger" in tables:  # older databases keep the seeds as their history
+                seeded = conn.execute("SELECT COALESCE(MAX(id), 0) FROM Ledger;").fetchone()[0]
+                for sql in COPY_LEDGER:
+                    conn.execute(sql, (guild_id, last_entry, seeded))
+            conn.execute("COMMIT;")
+            migrated += 1
+            log.info(f"Migrated guild {guild_id} from {path}")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK;")
+            log.error(f"Guild {guild_id} from {path} is not migrated: {e}")
+        finally:
+            conn.execute("DETACH DATABASE guild;")
+    conn.close()
+    log.info(f"Migrated {migrated} guilds into {shared_db_path} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    migrate()
@@ -24,6 +24,62 @@
 # Original library: https://github.com/RuCybernetic/Cybernator
 import discord
 import asyncio
+from modules.metrics import registry
+
+active_sessions = registry.gauge("bot_paginator_sessions", "Paginators waiting for reactions")
+
+
+class ReactionRouter:
+    """
+    One raw_reaction_add listener for all paginators. Payloads are routed by message id to the queue of the
+    session that owns the message, so an event costs a dict lookup instead of a check per waiting paginator
+    """
+    def __init__(self):
+        self.__sessions = {}
+        self.__bots = set()
+
+    def attach(self, bot):
+        if id(bot) not in self.__bots:
+            bot.add_listener(self.on_raw_reaction_add, "on_raw_reaction_add")
+            self.__bots.add(id(bot))
+
+    def open(self, message_id):
+        queue = asyncio.Queue()
+        self.__sessions[message_id] = queue
+        return queue
+
+    def close(self, message_id):
+        self.__sessions.pop(message_id, None)
+
+    async def on_raw_reaction_add(self, payload):
+        queue = self.__sessions.get(payload.message_id)
+        if queue is not None:
+            queue.put_nowait(payload)
+
+
+router = ReactionRouter()
+
+
+class PageSource:
+    """
+    Pages rendered on demand: render is an async callable that returns the embed of a page index.
+    Only pages within keep of the last viewed one stay cached, so a huge source costs the pages actually viewed
+    """
+    def __init__(self, count, render, keep=2):
+        self.count = count
+        self.render = render
+        self.keep = keep
+        self.__cache = {}
+
+    def __len__(self):
+        return self.count
+
+    async def get(self, index):
+        if index not in self.__cache:
+            self.__cache[index] = await self.render(index)
+        for cached in [i for i in self.__cache if abs(i - index) > self.keep]:
+            del self.__cache[cached]
+        return self.__cache[index]
 
 
 class Cybered(Exception):
@@ -54,7 +110,8 @@ class Paginator:
             more_reactions: list = ["⬅", "➡", "⏪", "⏩"],
             exit_reaction: list = ["⏹"],
             color: int = None,
-            use_remove_reaction: bool = True
+            use_remove_reaction: bool = True,
+            source: PageSource = None
     ):
         self.ctx = ctx
         self.message = message
@@ -77,14 +134,28 @@ class Paginator:
         self.color = color
         self.footer_icon = footer_icon
         self.use_remove_reaction = use_remove_reaction
+        self.source = source
 
-        if embeds is None:
+        if embeds is None and source is None:
             raise Cybered('Cybernetic съел ваш embeds.')
         if not isinstance(self.timeout, int):
             raise Cyberad('Что-то пошло не так...')
         if self.only is not None:
             if not isinstance(self.only, discord.abc.User):
                 raise TypeError
+        if source is not None and (use_more or use_images):
+            raise Cyberad('PageSource отдает только плоский список embed без картинок')
+
+    @property
+    def sections(self):
+        if self.source is not None:
+            return len(self.source)
+        return len(self.embeds)
+
+    async def section_embed(self, index):
+        if self.source is not None:
+            return await self.source.get(index)
+        return self.embeds[index]
 
     def emoji_checker(self, payload):
         if payload.user_id == self.ctx.user.id:
@@ -106,45 +177,54 @@ class Paginator:
         return False
 
     async def add_reactions(self):
-        if self.use_more:
-            for i in self.more_reactions:
-                await self.message.add_reaction(i)
-            if self.use_exit:
-                await self.message.add_reaction(self.exit_reaction[0])
-        else:
-            for i in self.reactions:
-                await self.message.add_reaction(i)
-            if self.use_exit:
-                await self.message.add_reaction(self.exit_reaction[0])
+        try:
+            if self.use_more:
+                for i in self.more_reactions:
+                    await self.message.add_reaction(i)
+                if self.use_exit:
+                    await self.message.add_reaction(self.exit_reaction[0])
+            else:
+                for i in self.reactions:
+                    await self.message.add_reaction(i)
+                if self.use_exit:
+                    await self.message.add_reaction(self.exit_reaction[0])
+        except discord.HTTPException:  # message deleted or no permission to react, session works without them
+            return False
         return True
 
     async def start(self):
+        active_sessions.inc()
+        try:
+            await self.run()
+        finally:
+            active_sessions.dec()
+
+    async def next_reaction(self, reactions):
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.timeout
+        while True:
+            payload = await asyncio.wait_for(reactions.get(), max(deadline - loop.time(), 0))
+            if self.emoji_checker(payload):
+                return payload
+
+    async def run(self):
         try:
             await self.section()
         except:
             await self.page()
-        await self.add_reactions()
+        router.attach(self.ctx)
+        reactions = router.open(self.message.id)
+        adding = asyncio.ensure_future(self.add_reactions())  # session reacts to input while emojis are added
+        try:
+            await self.listen(reactions, adding)
+        finally:
+            router.close(self.message.id)
+            adding.cancel()
 
+    async def listen(self, reactions, adding):
         while True:
             try:
-                add_reaction = asyncio.ensure_future(
-                    self.ctx.wait_for(
-                        "raw_reaction_add", check=self.emoji_checker
-                    )
-                )
-                done, pending = await asyncio.wait(
-                    (add_reaction, add_reaction),
-                    return_when=asyncio.FIRST_COMPLETED,
-                    timeout=self.timeout,
-                )
-
-                for i in pending:
-                    i.cancel()
-
-                if len(done) == 0:
-                    raise asyncio.TimeoutError()
-
-                payload = done.pop().result()
+                payload = await self.next_reaction(reactions)
                 await self.pagination(payload.emoji)
                 try:
                     if self.use_remove_reaction:
@@ -155,6 +235,7 @@ class Paginator:
                     pass
 
             except asyncio.TimeoutError:
+                adding.cancel()
                 try:
                     self.is_time_up = True
                     if self.delete_message:
@@ -219,7 +300,7 @@ class Paginator:
 
     async def go_section_next(self):
         try:
-            if self.index != len(self.embeds) - 1:
+            if self.index != self.sections - 1:
                 self.index += 1
                 await self.section()
         except Exception as e:
@@ -237,20 +318,21 @@ class Paginator:
                 pass
 
     async def section(self):
+        embed = await self.section_embed(self.index)
         if self.is_time_up:
-            self.embeds[self.index].set_footer(text=f'Раздел: [{1 + self.index}/{len(self.embeds)}] [Время вышло]',
-                                               icon_url=self.footer_icon if self.footer_icon is not None else '')
+            embed.set_footer(text=f'Раздел: [{1 + self.index}/{self.sections}] [Время вышло]',
+                             icon_url=self.footer_icon if self.footer_icon is not None else '')
         else:
-            self.embeds[self.index].set_footer(text=f'Раздел: [{1 + self.index}/{len(self.embeds)}]',
-                                               icon_url=self.footer_icon if self.footer_icon is not None else '')
+            embed.set_footer(text=f'Раздел: [{1 + self.index}/{self.sections}]',
+                             icon_url=self.footer_icon if self.footer_icon is not None else '')
         if self.time_stamp is True:
-            self.embeds[self.index].timestamp = self.message.created_at
+            embed.timestamp = self.message.created_at
         if self.color is not None:
-            self.embeds[self.index].colour = self.color
+            embed.colour = self.color
         if self.use_images:
-            return await self.message.edit(file=self.images[self.index], embed=self.embeds[self.index])
+            return await self.message.edit(file=self.images[self.index], embed=embed)
         else:
-            return await self.message.edit(embed=self.embeds[self.index])
+            return await self.message.edit(embed=embed)
 
     async def page(self):
         if self.is_time_up:
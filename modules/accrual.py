@@ -0,0 +1,109 @@
+# Copyright 2020 Артём Воронов
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from modules.baselogger import get_logger
+log = get_logger("accrual")
+
+
+class AccrualBuffer:
+    def __init__(self, threshold=500):
+        """
+        Write-behind buffer for activity rewards.
+        Rewards are summed in memory and written to the guild database in one transaction per guild
+        :param threshold: Number of buffered members in a guild after which it should be flushed
+        """
+        self.threshold = threshold
+        self.__pending = {}  # {guild_id: {member_id: [amount, member_name]}}
+        self.__writing = {}  # {id(buffer): (guild_id, buffer)} being written right now, still counted as pending
+
+    def add(self, guild_id, member_id, member_name, amount):
+        """
+        Buffer a reward for a member
+        :param guild_id: Guild id
+        :param member_id: Member id
+        :param member_name: Member name, used if the member has no row yet
+        :param amount: Reward amount
+        :return: True if the guild buffer reached the threshold and should be flushed
+        """
+        guild_pending = self.__pending.setdefault(guild_id, {})
+        entry = guild_pending.get(member_id)
+        if entry:
+            entry[0] += amount
+            entry[1] = member_name
+        else:
+            guild_pending[member_id] = [amount, member_name]
+        return len(guild_pending) >= self.threshold
+
+    def pending(self, guild_id, member_id):
+        """
+        :param guild_id: Guild id
+        :param member_id: Member id
+        :return: Amount buffered for a member and not written yet
+        """
+        amount = 0
+        entry = self.__pending.get(guild_id, {}).get(member_id)
+        if entry:
+            amount += entry[0]
+        for writing_guild_id, guild_pending in self.__writing.values():
+            if writing_guild_id == guild_id and member_id in guild_pending:
+                amount += guild_pending[member_id][0]
+        return amount
+
+    async def flush_guild(self, guild_id, gdb):
+        """
+        Write all buffered rewards of a guild in one transaction
+        :param guild_id: Guild id
+        :param gdb: Guild AsyncDataBase
+        :return: bool
+        """
+        guild_pending = self.__pending.pop(guild_id, None)
+        if not guild_pending:
+            return True
+        return await self.__write(guild_id, gdb, guild_pending)
+
+    async def flush_member(self, guild_id, member_id, gdb):
+        """
+        Write buffered rewards of one member, e.g. before their balance is read or changed
+        :param guild_id: Guild id
+        :param member_id: Member id
+        :param gdb: Guild AsyncDataBase
+        :return: bool
+        """
+        entry = self.__pending.get(guild_id, {}).pop(member_id, None)
+        if not entry:
+            return True
+        return await self.__write(guild_id, gdb, {member_id: entry})
+
+    async def flush_all(self, get_db):
+        """
+        Flush buffers of all guilds
+        :param get_db: Coroutine function returning guild AsyncDataBase by guild id
+        """
+        for guild_id in list(self.__pending):
+            await self.flush_guild(guild_id, await get_db(guild_id))
+
+    async def __write(self, guild_id, gdb, guild_pending):
+        rewards = [(member_id, entry[0], entry[1]) for member_id, entry in guild_pending.items()]
+        done = False
+        self.__writing[id(guild_pending)] = (guild_id, guild_pending)
+        try:
+            done = await gdb.increment_many("Members", "id", "money", rewards, ("tag",))
+        finally:
+            del self.__writing[id(guild_pending)]
+            if not done:
+                self.__restore(guild_id, guild_pending)
+        return done
+
+    def __restore(self, guild_id, guild_pending):
+        for member_id, entry in guild_pending.items():
+            self.add(guild_id, member_id, entry[1], entry[0])
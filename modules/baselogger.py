@@ -11,14 +11,47 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import atexit
 import logging
+import queue
 import sys
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from settings import log_file, log_max_bytes, log_backup_count, log_levels, log_rate_limits
 
 
 FORMATTER = logging.Formatter(
         fmt="[%(asctime)s] [%(filename)s:%(lineno)d] %(levelname)s: %(message)s",
         datefmt="%d/%b/%Y %H:%M:%S")
-LOG_FILE = "here.log"
+LOG_QUEUE = queue.SimpleQueue()
+listener = None  # writes records from LOG_QUEUE in background thread, started by first get_logger
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, per_second):
+        """
+        Drops records of a logger above per_second records per second. Errors are never dropped
+        :param per_second: Allowed records per second, bursts up to the same number
+        """
+        super().__init__()
+        self.per_second = per_second
+        self.tokens = per_second
+        self.updated = time.monotonic()
+        self.dropped = 0
+
+    def filter(self, record):
+        now = time.monotonic()
+        self.tokens = min(self.per_second, self.tokens + (now - self.updated) * self.per_second)
+        self.updated = now
+        if record.levelno < logging.ERROR:
+            if self.tokens < 1:
+                self.dropped += 1
+                return False
+            self.tokens -= 1
+        if self.dropped:
+            record.msg = f"{record.msg} ({self.dropped} records dropped by rate limit)"
+            self.dropped = 0
+        return True
 
 
 def get_console_handler():
@@ -28,15 +61,34 @@ def get_console_handler():
 
 
 def get_file_handler():
-    file_handler = logging.FileHandler(LOG_FILE)
+    file_handler = RotatingFileHandler(log_file, maxBytes=log_max_bytes, backupCount=log_backup_count,
+                                       encoding="utf-8")
     file_handler.setFormatter(FORMATTER)
     return file_handler
 
 
+def start_listener():
+    global listener
+    if listener is None:
+        listener = QueueListener(LOG_QUEUE, get_console_handler(), get_file_handler(), respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)  # writes records left in the queue
+
+
 def get_logger(logger_name):
+    """
+    Logger which only puts records in a queue, they are formatted and written by a background thread.
+    Level and rate limit of a logger are taken from log_levels and log_rate_limits settings
+    :param logger_name: Subsystem name, e.g. db or bot
+    :return: logging.Logger
+    """
+    start_listener()
     logger = logging.getLogger(logger_name)
-    logger.setLevel(logging.INFO)
-    logger.addHandler(get_console_handler())
-    logger.addHandler(get_file_handler())
+    logger.setLevel(log_levels.get(logger_name, logging.INFO))
+    if not any(isinstance(handler, QueueHandler) for handler in logger.handlers):  # logger may be requested again
+        handler = QueueHandler(LOG_QUEUE)
+        if logger_name in log_rate_limits:
+            handler.addFilter(RateLimitFilter(log_rate_limits[logger_name]))
+        logger.addHandler(handler)
     logger.propagate = False
     return logger
@@ -11,29 +11,97 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
+import copy
 import sqlite3
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from modules.baselogger import get_logger
+from modules.metrics import registry
 log = get_logger("db")
+query_seconds = registry.histogram("bot_db_query_seconds", "Time of database queries", ("operation", "table"))
+
+TUNING_PRAGMAS = ("journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store", "busy_timeout")
 
 
 class DataBase:
-    def __init__(self, path):
+    def __init__(self, path, check_same_thread=True, pragmas=None):
         """
         May create and connect to unique SQLite3 database
         :param path: Path to the db file
+        :param check_same_thread: If false, connection may be used by other threads (one at a time)
+        :param pragmas: Tuning profile, dict of {pragma: value} with keys from TUNING_PRAGMAS
         """
+        self.__scope = None  # (column, value) condition added to every query, see scoped()
         try:
             self.__path = path
 
             if not os.path.exists("data/databases"):
-                if not os.path.exists("data"):
-                    os.mkdir("data")
-                os.mkdir("data/databases")
+                os.makedirs("data/databases", exist_ok=True)  # databases may be opened from several threads
                 log.info(f"Created dir: data/databases/")
 
-            self.__conn = sqlite3.connect(self.__path)
+            self.__conn = sqlite3.connect(self.__path, check_same_thread=check_same_thread)
             self.__cursor = self.__conn.cursor()
+            self.tune(pragmas or {})
+        except sqlite3.Error as e:
+            log.error(e)
+
+    def scoped(self, column, value):
+        """
+        View of the database sharing its connection, which reads and writes only rows with column = value.
+        Lets many guilds keep their rows in the same tables. Column must be the last column of scoped tables,
+        so rows have the same layout as in a not scoped database
+        :param column: Scope column, e.g. guild_id
+        :param value: Scope value
+        :return: DataBase
+        """
+        view = copy.copy(self)
+        view.__scope = (column, value)
+        return view
+
+    def __where(self, *conditions):
+        """
+        :param conditions: SQL conditions with ? placeholders
+        :return: (where clause including scope condition, scope params to put before params of conditions)
+        """
+        params = []
+        if self.__scope:
+            conditions = (f"{self.__scope[0]} = ?",) + conditions
+            params.append(self.__scope[1])
+        if not conditions:
+            return "", params
+        return " where " + " AND ".join(conditions), params
+
+    def __rollback(self):
+        """
+        End the implicit transaction left open by a failed write, so later explicit transactions can BEGIN
+        """
+        try:
+            if self.__conn.in_transaction:
+                self.__conn.rollback()
+        except sqlite3.Error as e:
+            log.error(e)
+
+    def tune(self, pragmas):
+        """
+        Apply tuning profile to the connection
+        :param pragmas: Dict of {pragma: value} with keys from TUNING_PRAGMAS, e.g. {"journal_mode": "WAL"}
+        """
+        for pragma, value in pragmas.items():
+            if pragma not in TUNING_PRAGMAS:
+                log.warning(f"[{self.__path}] Unknown tuning pragma {pragma} is skipped")
+                continue
+            result = self.__cursor.execute(f"""PRAGMA {pragma} = {value};""").fetchone()
+            if pragma == "journal_mode" and str(result[0]).lower() != str(value).lower():
+                log.warning(f"[{self.__path}] journal_mode is {result[0]} instead of {value}")
+
+    def close(self):
+        """
+        Close connection to the database
+        """
+        try:
+            self.__conn.close()
         except sqlite3.Error as e:
             log.error(e)
 
@@ -63,6 +131,7 @@ class DataBase:
             log.info(f"[{self.__path}] Create new table {name} with (id PRIMARY KEY UNIQUE NOT NULL{columns})")
             return True
         except sqlite3.Error as e:
+            self.__rollback()
             handler_errors = ["table Guilds already exists", "table Members already exists", "table Orgs already exists", "table Shop already exists"]
             if str(e) in handler_errors:
                 if str(e) == "table Guilds already exists":
@@ -71,21 +140,48 @@ class DataBase:
             log.error(e)
             return False
 
-    def insert(self, table, columns="", values=""):
+    def insert(self, table, columns="", values=()):
         """
         Represent an INSERT SQlite3 execute
         :param table: Table name
         :param columns: Columns you want to insert
-        :param values: Values of inserting columns
+        :param values: Tuple of values of inserting columns
         :return: bool
         """
         try:
+            values = tuple(values)
+            if self.__scope:
+                values += (self.__scope[1],)
+                if columns:
+                    columns = f"{columns}, {self.__scope[0]}"
             if columns:
                 columns = f"({columns})"
             self.__cursor.execute(
-                f"""INSERT INTO {table}{columns} VALUES({values});""")
+                f"""INSERT INTO {table}{columns} VALUES({placeholders(len(values))});""", values)
             self.__conn.commit()
-            log.info(f"[{self.__path}] Insert row in {table}{columns} VALUES({values})")
+            log.debug(f"[{self.__path}] Insert row in {table}{columns} VALUES{tuple(values)}")
+            return True
+        except sqlite3.Error as e:
+            self.__rollback()
+            log.error(e)
+            return False
+
+    def insert_many(self, table, columns, rows):
+        """
+        Represent an INSERT SQlite3 executemany in one transaction
+        :param table: Table name
+        :param columns: Columns you want to insert
+        :param rows: List of tuples of values of inserting columns
+        :return: bool
+        """
+        try:
+            if self.__scope:
+                columns = f"{columns}, {self.__scope[0]}"
+                rows = [(*row, self.__scope[1]) for row in rows]
+            with self.__conn:
+                self.__cursor.executemany(
+                    f"""INSERT INTO {table}({columns}) VALUES({placeholders(len(columns.split(",")))});""", rows)
+            log.debug(f"[{self.__path}] Insert {len(rows)} rows in {table}({columns})")
             return True
         except sqlite3.Error as e:
             log.error(e)
@@ -99,14 +195,15 @@ class DataBase:
         :param key: Value of key column in the updating row
         :param column: Column you want to update
         :param value: New value for updating column
-        :return: bool
+        :return: True if the row exists and was updated
         """
         try:
-            self.__cursor.execute(
-                f"""UPDATE {table} SET {column} = {value} where {key_column} = {key};""")
+            where, params = self.__where(f"{key_column} = ?")
+            self.__cursor.execute(f"""UPDATE {table} SET {column} = ?{where};""", (value, *params, key))
             self.__conn.commit()
-            return True
+            return self.__cursor.rowcount > 0
         except sqlite3.Error as e:
+            self.__rollback()
             log.error(e)
             return False
 
@@ -119,13 +216,246 @@ class DataBase:
         :return: bool
         """
         try:
-            self.__cursor.execute(f"""DELETE FROM {table} where {key_column} = {key};""")
+            where, params = self.__where(f"{key_column} = ?")
+            self.__cursor.execute(f"""DELETE FROM {table}{where};""", (*params, key))
             self.__conn.commit()
             return True
+        except sqlite3.Error as e:
+            self.__rollback()
+            log.error(e)
+            return False
+
+    def upsert(self, table, key_column, values, update_columns=None):
+        """
+        Represent an INSERT ... ON CONFLICT DO UPDATE SQlite3 execute
+        :param table: Table name
+        :param key_column: Unique column of the row
+        :param values: Dict of {column: value} for the row, including key column
+        :param update_columns: Columns to update if the row exists. Def: all except key column
+        :return: bool
+        """
+        if update_columns is None:
+            update_columns = [column for column in values if column != key_column]
+        updates = ", ".join(f"{column} = excluded.{column}" for column in update_columns)
+        conflict = key_column
+        if self.__scope:
+            values = {**values, self.__scope[0]: self.__scope[1]}
+            conflict = f"{self.__scope[0]}, {key_column}"
+        try:
+            self.__cursor.execute(
+                f"""INSERT INTO {table}({", ".join(values)}) VALUES({placeholders(len(values))}) """
+                f"""ON CONFLICT({conflict}) DO UPDATE SET {updates};""", tuple(values.values()))
+            self.__conn.commit()
+            return True
+        except sqlite3.Error as e:
+            self.__rollback()
+            log.error(e)
+            return False
+
+    def upsert_many(self, table, key_column, columns, rows, update_columns=None):
+        """
+        Represent many INSERT ... ON CONFLICT DO UPDATE in one executemany transaction
+        :param table: Table name
+        :param key_column: Unique column of the rows
+        :param columns: List of columns of rows, including key column
+        :param rows: List of value tuples in order of columns
+        :param update_columns: Columns to update if a row exists. Def: all except key column
+        :return: bool
+        """
+        if update_columns is None:
+            update_columns = [column for column in columns if column != key_column]
+        updates = ", ".join(f"{column} = excluded.{column}" for column in update_columns)
+        columns = list(columns)
+        conflict = key_column
+        if self.__scope:
+            columns.append(self.__scope[0])
+            conflict = f"{self.__scope[0]}, {key_column}"
+            rows = [(*row, self.__scope[1]) for row in rows]
+        try:
+            with self.__conn:
+                self.__cursor.executemany(
+                    f"""INSERT INTO {table}({", ".join(columns)}) VALUES({placeholders(len(columns))}) """
+                    f"""ON CONFLICT({conflict}) DO UPDATE SET {updates};""", rows)
+            return True
+        except sqlite3.Error as e:
+            log.error(e)
+            return False
+
+    def increment(self, table, key_column, key, column, amount, insert_values=None, minimum=None):
+        """
+        Add amount to a column in one statement, without reading the row first
+        :param table: Table name
+        :param key_column: Column by which you want to search for an updating row
+        :param key: Value of key column in the updating row
+        :param column: Column you want to increase
+        :param amount: Value added to the column, may be negative
+        :param insert_values: Dict of {column: value} of other columns. If given, missing row is created
+        :param minimum: Lower bound of the new value, e.g. 0 to never go below zero. Used without insert_values
+        :return: New value of the column or None if there is no such row
+        """
+        try:
+            if insert_values is None:
+                sql, params = self.__add_sql(table, key_column, column, minimum)
+                self.__cursor.execute(sql, (amount, *params, key))
+            else:
+                scope_values = self.__scope[1:] if self.__scope else ()
+                self.__cursor.execute(self.__increment_sql(table, key_column, column, insert_values),
+                                      (key, amount, *insert_values.values(), *scope_values))
+            self.__conn.commit()
+            return self.read(table, key_column, key, column)[0] if self.__cursor.rowcount else None
+        except sqlite3.Error as e:
+            self.__rollback()
+            log.error(e)
+            return None
+
+    def increment_pairs(self, table, key_column, column, pairs, minimum=None):
+        """
+        Add amounts to a column of several existing rows in one transaction, e.g. points of many orgs after an event
+        :param table: Table name
+        :param key_column: Column by which you want to search for updating rows
+        :param column: Column you want to increase
+        :param pairs: List of (key, amount), keys are unique
+        :param minimum: Lower bound of new values
+        :return: Dict of {key: (new value, actual change) or None if there is no such row}, None on error.
+        The change differs from the amount when the value is bounded by minimum
+        """
+        try:
+            sql, params = self.__add_sql(table, key_column, column, minimum)
+            where, where_params = self.__where(f"{key_column} = ?")
+            select = f"""SELECT {column} FROM {table}{where};"""
+            results = {}
+            with self.__conn:
+                for key, amount in pairs:
+                    before = self.__cursor.execute(select, (*where_params, key)).fetchone()
+                    if before is None:
+                        results[key] = None
+                        continue
+                    self.__cursor.execute(sql, (amount, *params, key))
+                    now = self.__cursor.execute(select, (*where_params, key)).fetchone()[0]
+                    results[key] = (now, now - before[0])
+            return results
+        except sqlite3.Error as e:
+            log.error(e)
+            return None
+
+    def __add_sql(self, table, key_column, column, minimum=None):
+        """
+        :return: (UPDATE adding the first param to column, params between the amount and the key)
+        """
+        where, params = self.__where(f"{key_column} = ?")
+        if minimum is None:
+            return f"""UPDATE {table} SET {column} = {column} + ?{where};""", params
+        return f"""UPDATE {table} SET {column} = MAX({column} + ?, ?){where};""", [minimum, *params]
+
+    def debit(self, table, key_column, key, column, amount):
+        """
+        Subtract amount from a column in one statement only if the column holds at least amount
+        :param table: Table name
+        :param key_column: Column by which you want to search for an updating row
+        :param key: Value of key column in the updating row
+        :param column: Column you want to decrease
+        :param amount: Value subtracted from the column
+        :return: New value of the column or None if there is no such row or the column holds less than amount
+        """
+        try:
+            where, params = self.__where(f"{key_column} = ?", f"{column} >= ?")
+            self.__cursor.execute(f"""UPDATE {table} SET {column} = {column} - ?{where};""",
+                                  (amount, *params, key, amount))
+            self.__conn.commit()
+            return self.read(table, key_column, key, column)[0] if self.__cursor.rowcount else None
+        except sqlite3.Error as e:
+            self.__rollback()
+            log.error(e)
+            return None
+
+    def debit_many(self, table, key_column, column, rows):
+        """
+        Represent many debits in one executemany transaction. Rows holding less than their amount are left as they are
+        :param table: Table name
+        :param key_column: Column by which you want to search for updating rows
+        :param column: Column you want to decrease
+        :param rows: List of (key, amount)
+        :return: Number of debited rows or None on error
+        """
+        try:
+            where, params = self.__where(f"{key_column} = ?", f"{column} >= ?")
+            with self.__conn:
+                self.__cursor.executemany(f"""UPDATE {table} SET {column} = {column} - ?{where};""",
+                                          [(amount, *params, key, amount) for key, amount in rows])
+            return self.__cursor.rowcount
+        except sqlite3.Error as e:
+            log.error(e)
+            return None
+
+    def increment_many(self, table, key_column, column, rows, insert_columns=()):
+        """
+        Represent many increments in one transaction. Missing rows are created
+        :param table: Table name
+        :param key_column: Column by which you want to search for an updating row
+        :param column: Column you want to increase
+        :param rows: List of (key, amount, *values of insert_columns)
+        :param insert_columns: Other columns filled in created rows
+        :return: bool
+        """
+        try:
+            if self.__scope:
+                rows = [(*row, self.__scope[1]) for row in rows]
+            with self.__conn:
+                self.__cursor.executemany(self.__increment_sql(table, key_column, column, insert_columns), rows)
+            return True
+        except sqlite3.Error as e:
+            log.error(e)
+            return False
+
+    def __increment_sql(self, table, key_column, column, insert_columns):
+        columns = [key_column, column, *insert_columns]
+        conflict = key_column
+        if self.__scope:
+            columns.append(self.__scope[0])
+            conflict = f"{self.__scope[0]}, {key_column}"
+        return f"""INSERT INTO {table}({", ".join(columns)}) VALUES({placeholders(len(columns))}) """ \
+               f"""ON CONFLICT({conflict}) DO UPDATE SET {column} = {column} + excluded.{column};"""
+
+    def execute_transaction(self, *statements):
+        """
+        Represent several SQlite3 executes in one explicit transaction, schema changes included.
+        Statements are not scoped
+        :param statements: Tuples of (sql, params)
+        :return: bool
+        """
+        try:
+            with self.__conn:
+                self.__cursor.execute("BEGIN;")
+                for sql, params in statements:
+                    self.__cursor.execute(sql, params)
+            return True
         except sqlite3.Error as e:
             log.error(e)
             return False
 
+    def migrate(self, migrations):
+        """
+        Bring the database schema to the latest version. The version is kept in PRAGMA user_version,
+        so an up-to-date database costs one pragma read. All pending migrations are applied in one transaction
+        :param migrations: List of migrations, each is a list of SQL statements
+        :return: Schema version or None on error
+        """
+        try:
+            version = self.__cursor.execute("PRAGMA user_version;").fetchone()[0]
+            if version >= len(migrations):
+                return version
+            with self.__conn:
+                self.__cursor.execute("BEGIN;")
+                for migration in migrations[version:]:
+                    for sql in migration:
+                        self.__cursor.execute(sql)
+                self.__cursor.execute(f"PRAGMA user_version = {len(migrations)};")
+            log.info(f"[{self.__path}] Migrated schema from version {version} to {len(migrations)}")
+            return len(migrations)
+        except sqlite3.Error as e:
+            log.error(e)
+            return None
+
     def read(self, table, key_column, key, columns_to_read="*"):
         """
         Represent an SELECT.fetchone SQlite3 execute
@@ -136,12 +466,30 @@ class DataBase:
         :return: result
         """
         try:
-            result = self.__cursor.execute(f"""SELECT {columns_to_read} FROM {table} where {key_column} = {key};""").fetchone()
+            where, params = self.__where(f"{key_column} = ?")
+            result = self.__cursor.execute(f"""SELECT {columns_to_read} FROM {table}{where};""", (*params, key)).fetchone()
             return result
         except sqlite3.Error as e:
             log.error(e)
             return None
 
+    def rank(self, table, column, value):
+        """
+        Place of a value in a table sorted by column in descending order.
+        Counts only greater values, so with an index on column it doesn't read or sort the table
+        :param table: Table name
+        :param column: Column by which the table is sorted
+        :param value: Value which place you want to know
+        :return: result
+        """
+        try:
+            where, params = self.__where(f"{column} > ?")
+            result = self.__cursor.execute(f"""SELECT COUNT(*) FROM {table}{where};""", (*params, value)).fetchone()
+            return result[0] + 1
+        except sqlite3.Error as e:
+            log.error(e)
+            return None
+
     def read_many(self, table, size, columns_to_read="*"):
         """
         Represent an SELECT.fetchmany SQlite3 execute
@@ -151,7 +499,8 @@ class DataBase:
         :return: result
         """
         try:
-            result = self.__cursor.execute(f"""SELECT {columns_to_read} FROM {table};""").fetchmany(size)
+            where, params = self.__where()
+            result = self.__cursor.execute(f"""SELECT {columns_to_read} FROM {table}{where};""", params).fetchmany(size)
             return result
         except sqlite3.Error as e:
             log.error(e)
@@ -165,12 +514,93 @@ class DataBase:
         :return: result
         """
         try:
-            result = self.__cursor.execute(f"""SELECT {columns_to_read} FROM {table};""").fetchall()
+            where, params = self.__where()
+            result = self.__cursor.execute(f"""SELECT {columns_to_read} FROM {table}{where};""", params).fetchall()
             return result
         except sqlite3.Error as e:
             log.error(e)
             return None
 
+    def read_batch(self, table, after=None, size=500, columns_to_read="*"):
+        """
+        Batch of rows in rowid order, the query behind AsyncDataBase.iter_rows
+        :param table: Table name
+        :param after: Rowid returned with the previous batch, None for the first batch
+        :param size: Number of rows in the batch
+        :param columns_to_read: Default set to all
+        :return: (rows, rowid of the last row or None if there are no rows), None on error
+        """
+        try:
+            where, params = self.__where(*(["rowid > ?"] if after is not None else []))
+            rows = self.__cursor.execute(f"""SELECT rowid, {columns_to_read} FROM {table}{where} ORDER BY rowid LIMIT ?;""",
+                                         (*params, *([after] if after is not None else []), size)).fetchall()
+            return [row[1:] for row in rows], rows[-1][0] if rows else None
+        except sqlite3.Error as e:
+            log.error(e)
+            return None
+
+    def read_all_by(self, table, key_column, key, columns_to_read="*", order_key=None, mod="ASC", size=None):
+        """
+        Represent an SELECT.fetchall SQlite3 execute of rows with a value in a column
+        :param table: Table name
+        :param key_column: Column by which you want to search for rows
+        :param key: Value of key column in the rows
+        :param columns_to_read: Default set to all
+        :param order_key: Column by which you want to sort, rows are not sorted by default
+        :param mod: Sorting order: ASC (default) / DESC
+        :param size: Maximum number of rows, all rows by default
+        :return: result
+        """
+        try:
+            where, params = self.__where(f"{key_column} = ?")
+            order = f" ORDER BY {order_key} {mod}" if order_key else ""
+            limit = " LIMIT ?" if size is not None else ""
+            result = self.__cursor.execute(f"""SELECT {columns_to_read} FROM {table}{where}{order}{limit};""",
+                                           (*params, key, *([size] if size is not None else []))).fetchall()
+            return result
+        except sqlite3.Error as e:
+            log.error(e)
+            return None
+
+    def read_page(self, table, order_key, size, after=None, columns_to_read="*", mod="DESC", id_column="id"):
+        """
+        Keyset pagination: a page of rows ordered by (order_key, id_column) starting after a cursor.
+        With an index on (order_key, id_column) every page costs the same, no matter how deep it is
+        :param table: Table name
+        :param order_key: Column by which you want to sort
+        :param size: Number of rows in the page
+        :param after: Cursor returned with the previous page, None for the first page
+        :param columns_to_read: Default set to all
+        :param mod: Sorting order: DESC (default) / ASC
+        :param id_column: Unique column breaking ties of order_key
+        :return: (rows, cursor of the next page or None if this page is the last one), None on error
+        """
+        try:
+            conditions = []
+            if after is not None:
+                conditions.append(f"({order_key}, {id_column}) {'<' if mod.upper() == 'DESC' else '>'} (?, ?)")
+            where, params = self.__where(*conditions)
+            rows = self.__cursor.execute(
+                f"""SELECT {columns_to_read}, {order_key}, {id_column} FROM {table}{where} """
+                f"""ORDER BY {order_key} {mod}, {id_column} {mod} LIMIT ?;""", (*params, *(after or ()), size)).fetchall()
+            cursor = tuple(rows[-1][-2:]) if len(rows) == size else None
+            return [row[:-2] for row in rows], cursor
+        except sqlite3.Error as e:
+            log.error(e)
+            return None
+
+    def count(self, table):
+        """
+        :param table: Table name
+        :return: Number of rows, None on error
+        """
+        try:
+            where, params = self.__where()
+            return self.__cursor.execute(f"""SELECT COUNT(*) FROM {table}{where};""", params).fetchone()[0]
+        except sqlite3.Error as e:
+            log.error(e)
+            return None
+
     def read_all_by_order(self, table, order_key, columns_to_read="*", mod="ASC"):
         """
         Represent an ordered SELECT.fetchall SQlite3 execute
@@ -181,9 +611,125 @@ class DataBase:
         :return: result
         """
         try:
-            result = self.__cursor.execute(f"SELECT {columns_to_read} FROM {table} ORDER BY {order_key} {mod};").fetchall()
+            where, params = self.__where()
+            result = self.__cursor.execute(f"SELECT {columns_to_read} FROM {table}{where} ORDER BY {order_key} {mod};", params).fetchall()
             return result
         except sqlite3.Error as e:
             log.error(e)
             return None
 
+
+def placeholders(count):
+    return ", ".join("?" * count)
+
+
+
+class AsyncDataBase:
+    executor = None  # shared by all databases, created on first use
+
+    def __init__(self, path, workers=4, pragmas=None, reopen=None):
+        """
+        Awaitable DataBase. Every DataBase method is available as a coroutine:
+        await gdb.read("Members", "id", member_id)
+        Queries run in a bounded thread pool shared by all databases, one query per database at a time
+        :param path: Path to the db file
+        :param workers: Size of the shared thread pool, used by the first created database
+        :param pragmas: Tuning profile, see DataBase
+        :param reopen: Coroutine function returning the database which replaces this one once it's closed,
+        e.g. GuildDataBases.get. Without it queries to a closed database raise sqlite3.ProgrammingError
+        """
+        if AsyncDataBase.executor is None:
+            AsyncDataBase.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+        self.__path = path
+        self.__pragmas = pragmas
+        self.__db = None  # connected in the pool on first query
+        self.__lock = asyncio.Lock()  # waiting queries of this database
+        self.__closed = False
+        self.__reopen = reopen
+        self.__root = self  # database owning the connection, differs for scoped views
+        self.__scope = None
+
+    def scoped(self, column, value):
+        """
+        Awaitable DataBase.scoped view. Shares connection and queries queue with this database
+        :param column: Scope column, e.g. guild_id
+        :param value: Scope value
+        :return: AsyncDataBase
+        """
+        view = copy.copy(self)
+        view.__scope = (column, value)
+        return view
+
+    def __getattr__(self, name):
+        if name.startswith("_") or not callable(getattr(DataBase, name, None)):
+            raise AttributeError(name)
+
+        async def query(*args, **kwargs):
+            return await self.run(name, *args, **kwargs)
+        query.__name__ = name
+        return query
+
+    def __call(self, name, *args, **kwargs):
+        root = self.__root
+        if root.__db is None:
+            root.__db = DataBase(self.__path, check_same_thread=False, pragmas=self.__pragmas)
+        db = root.__db if self.__scope is None else root.__db.scoped(*self.__scope)
+        return getattr(db, name)(*args, **kwargs)
+
+    async def run(self, name, *args, **kwargs):
+        """
+        Run a DataBase method in the thread pool
+        :param name: DataBase method name
+        :return: result of the method
+        """
+        root = self.__root
+        async with root.__lock:
+            if not root.__closed:
+                started = time.perf_counter()
+                try:
+                    return await asyncio.get_event_loop().run_in_executor(
+                        self.executor, lambda: self.__call(name, *args, **kwargs))
+                finally:
+                    table = args[0] if args and isinstance(args[0], str) else ""
+                    query_seconds.observe(time.perf_counter() - started, name, table)
+
+        # held by a caller after it was closed, so the query goes to the database replacing it
+        if root.__reopen is None:
+            raise sqlite3.ProgrammingError(f"Cannot operate on a closed database: {self.__path}")
+        reopened = await root.__reopen()
+        if self.__scope is not None:
+            reopened = reopened.scoped(*self.__scope)
+        return await reopened.run(name, *args, **kwargs)
+
+    async def iter_rows(self, table, columns_to_read="*", batch_size=500):
+        """
+        Async iterator over rows, read in rowid order by batches of batch_size:
+        async for member_id, money in gdb.iter_rows("Members", "id, money"): ...
+        Every batch is a separate query, so the connection isn't held while the rows are processed
+        :param table: Table name
+        :param columns_to_read: Default set to all
+        :param batch_size: Rows read by one query
+        :raise sqlite3.Error: A batch can't be read, so callers don't take the rows read so far for the whole table
+        """
+        after = None
+        while True:
+            result = await self.run("read_batch", table, after, batch_size, columns_to_read)
+            if result is None:
+                raise sqlite3.Error(f"Reading {table} after rowid {after} failed")
+            rows, after = result
+            for row in rows:
+                yield row
+            if len(rows) < batch_size:
+                return
+
+    async def close(self):
+        """
+        Close connection to the database after all queued queries. Scoped views don't own the connection
+        """
+        if self.__root is not self:
+            return
+        async with self.__lock:
+            self.__closed = True
+            if self.__db is not None:
+                db, self.__db = self.__db, None
+                await asyncio.get_event_loop().run_in_executor(self.executor, db.close)
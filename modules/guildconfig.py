@@ -0,0 +1,157 @@
+# Copyright 2020 Артём Воронов
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Optional, Set
+from modules.baselogger import get_logger
+import settings
+log = get_logger("config")
+
+COLUMNS = "id, prefix, admin_roles, reward_window, reward_limit, reward_min_length"
+
+
+@dataclass
+class GuildConfig:
+    guild_id: int
+    prefix: Optional[str] = None
+    admin_roles: Set[int] = field(default_factory=set)
+    reward_window: float = settings.reward_window
+    reward_limit: float = settings.reward_limit
+    reward_min_length: int = settings.reward_min_length
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        :param row: Row of Guilds table with COLUMNS. Empty reward columns mean defaults from settings
+        :return: GuildConfig
+        """
+        admin_roles = {int(role) for role in str(row[2]).split(";") if role} if row[2] else set()
+        policy = {name: value for name, value in zip(("reward_window", "reward_limit", "reward_min_length"), row[3:])
+                  if value is not None}
+        return cls(row[0], row[1] or None, admin_roles, **policy)
+
+    @property
+    def prefixes(self):
+        """
+        :return: Tuple of the guild prefixes, prefix holds them separated by ";"
+        """
+        return tuple(prefix for prefix in self.prefix.split(";") if prefix) if self.prefix else ()
+
+
+class GuildConfigCache:
+    def __init__(self, db):
+        """
+        In-memory copy of the Guilds table. Reads never touch the database,
+        every write goes to the database first and then reloads the changed guild
+        :param db: Bot AsyncDataBase with Guilds table
+        """
+        self.__db = db
+        self.__configs = {}  # {guild_id: GuildConfig}
+
+    def __contains__(self, guild_id):
+        return guild_id in self.__configs
+
+    def get(self, guild_id):
+        """
+        :param guild_id: Guild id
+        :return: GuildConfig of the guild, default one if the guild is unknown
+        """
+        config = self.__configs.get(guild_id)
+        return config if config else GuildConfig(guild_id)
+
+    async def load(self):
+        """
+        Load configs of all guilds. Cached configs are kept if the table can't be read
+        """
+        configs = {}
+        try:
+            async for row in self.__db.iter_rows("Guilds", COLUMNS):
+                configs[row[0]] = GuildConfig.from_row(row)
+        except sqlite3.Error as e:
+            log.error(f"Guild configs are not loaded, keeping {len(self.__configs)} cached: {e}")
+            return
+        self.__configs = configs
+        log.info(f"Loaded config of {len(self.__configs)} guilds")
+
+    async def reload(self, guild_id):
+        """
+        Read config of a guild again. The cached config is kept if the row can't be read
+        :param guild_id: Guild id
+        """
+        row = await self.__db.read("Guilds", "id", guild_id, COLUMNS)
+        if row:
+            self.__configs[guild_id] = GuildConfig.from_row(row)
+
+    async def add(self, guild_id):
+        """
+        Add a new guild with default config
+        :param guild_id: Guild id
+        """
+        await self.__db.insert("Guilds", "id", (guild_id,))
+        await self.reload(guild_id)
+
+    async def add_many(self, guild_ids):
+        """
+        Add new guilds with default config in one transaction
+        :param guild_ids: Guild ids
+        """
+        await self.__db.insert_many("Guilds", "id", [(guild_id,) for guild_id in guild_ids])
+        await self.load()
+
+    async def set_prefix(self, guild_id, prefix):
+        """
+        :param guild_id: Guild id
+        :param prefix: New commands prefix
+        """
+        await self.__db.update("Guilds", "id", guild_id, "prefix", prefix)
+        await self.reload(guild_id)
+
+    async def set_reward_policy(self, guild_id, window, limit, min_length):
+        """
+        :param guild_id: Guild id
+        :param window: Seconds of an earning window, 0 to disable the limit
+        :param limit: Coins a member can earn in one window
+        :param min_length: Characters of the shortest rewarded message
+        """
+        await self.__db.upsert("Guilds", "id", {"id": guild_id, "reward_window": window, "reward_limit": limit,
+                                                "reward_min_length": min_length})
+        await self.reload(guild_id)
+
+    async def add_admin_role(self, guild_id, role_id):
+        """
+        :param guild_id: Guild id
+        :param role_id: Id of role getting access to admin commands
+        :return: False if the role is already an admin role
+        """
+        admin_roles = self.get(guild_id).admin_roles
+        if role_id in admin_roles:
+            return False
+        await self.__write_admin_roles(guild_id, admin_roles | {role_id})
+        return True
+
+    async def remove_admin_role(self, guild_id, role_id):
+        """
+        :param guild_id: Guild id
+        :param role_id: Id of role losing access to admin commands
+        :return: False if the role is not an admin role
+        """
+        admin_roles = self.get(guild_id).admin_roles
+        if role_id not in admin_roles:
+            return False
+        await self.__write_admin_roles(guild_id, admin_roles - {role_id})
+        return True
+
+    async def __write_admin_roles(self, guild_id, admin_roles):
+        await self.__db.update("Guilds", "id", guild_id, "admin_roles", ";".join(map(str, admin_roles)))
+        await self.reload(guild_id)
@@ -0,0 +1,155 @@
+# Copyright 2020 Артём Воронов
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+from collections import OrderedDict
+from modules.baselogger import get_logger
+from modules.database import AsyncDataBase
+log = get_logger("guild_db")
+
+
+class GuildDataBases:
+    def __init__(self, path, prepare, max_open=128, pragmas=None):
+        """
+        Opens guild databases on first access and keeps at most max_open of them connected.
+        The least recently used database is closed when the limit is reached
+        :param path: Path template of guild db files, formatted with guild id
+        :param prepare: Coroutine function called with every newly opened database, e.g. to create tables
+        :param max_open: Maximum number of connected databases
+        :param pragmas: Tuning profile of guild databases, see DataBase
+        """
+        self.__path = path
+        self.__pragmas = pragmas
+        self.__prepare = prepare
+        self.max_open = max_open
+        self.__open = OrderedDict()  # {guild_id: AsyncDataBase}, least recently used first
+        self.__preparing = {}  # {guild_id: Task}
+        self.hits = 0
+        self.opens = 0
+        self.evictions = 0
+
+    def __contains__(self, guild_id):
+        return guild_id in self.__open
+
+    def __len__(self):
+        return len(self.__open)
+
+    def opened(self):
+        """
+        :return: Ids of guilds whose databases are connected, least recently used first
+        """
+        return list(self.__open)
+
+    @property
+    def stats(self):
+        return {"open": len(self.__open), "max_open": self.max_open,
+                "hits": self.hits, "opens": self.opens, "evictions": self.evictions}
+
+    async def get(self, guild_id):
+        """
+        :param guild_id: Guild id
+        :return: Prepared AsyncDataBase of the guild
+        """
+        gdb = self.__open.get(guild_id)
+        if gdb is not None:
+            self.__open.move_to_end(guild_id)
+            self.hits += 1
+        else:
+            gdb = AsyncDataBase(self.__path.format(guild_id), pragmas=self.__pragmas,
+                                reopen=lambda: self.get(guild_id))  # for callers still holding it after eviction
+            self.__open[guild_id] = gdb
+            self.__preparing[guild_id] = asyncio.ensure_future(self.__prepare(gdb))
+            self.opens += 1
+            while len(self.__open) > self.max_open:
+                await self.__evict()
+
+        preparing = self.__preparing.get(guild_id)
+        if preparing:
+            try:
+                await asyncio.shield(preparing)
+            finally:
+                if preparing.done() and self.__preparing.get(guild_id) is preparing:
+                    del self.__preparing[guild_id]
+        return gdb
+
+    async def close_all(self):
+        """
+        Close all connected databases
+        """
+        log.info(f"Closing guild databases: {self.stats}")
+        while self.__open:
+            await self.__open.popitem(last=False)[1].close()
+
+    async def __evict(self):
+        guild_id, gdb = self.__open.popitem(last=False)
+        self.__preparing.pop(guild_id, None)
+        self.evictions += 1
+        await gdb.close()  # runs after queries already queued for this database
+
+
+class SharedGuildDataBases:
+    def __init__(self, path, prepare, pragmas=None):
+        """
+        Same interface as GuildDataBases, but all guilds are kept in one database.
+        Every guild gets a view of it, scoped by guild_id column
+        :param path: Path to the shared db file
+        :param prepare: Coroutine function called once with the shared database, e.g. to create tables
+        :param pragmas: Tuning profile of the shared database, see DataBase
+        """
+        self.__db = AsyncDataBase(path, pragmas=pragmas)
+        self.__prepare = prepare
+        self.__preparing = None
+        self.__views = {}  # {guild_id: scoped AsyncDataBase}
+        self.hits = 0
+        self.opens = 0
+
+    def __contains__(self, guild_id):
+        return guild_id in self.__views
+
+    def __len__(self):
+        return len(self.__views)
+
+    def opened(self):
+        """
+        :return: Ids of guilds whose views were handed out
+        """
+        return list(self.__views)
+
+    @property
+    def stats(self):
+        return {"open": len(self.__views), "hits": self.hits, "opens": self.opens}
+
+    async def get(self, guild_id):
+        """
+        :param guild_id: Guild id
+        :return: AsyncDataBase view of the guild
+        """
+        if self.__preparing is None:
+            self.__preparing = asyncio.ensure_future(self.__prepare(self.__db))
+        await asyncio.shield(self.__preparing)
+
+        gdb = self.__views.get(guild_id)
+        if gdb is not None:
+            self.hits += 1
+        else:
+            gdb = self.__views[guild_id] = self.__db.scoped("guild_id", guild_id)
+            self.opens += 1
+        return gdb
+
+    async def close_all(self):
+        """
+        Close the shared database
+        """
+        log.info(f"Closing shared guild database: {self.stats}")
+        self.__views.clear()
+        await self.__db.close()
@@ -0,0 +1,75 @@
+# Copyright 2020 Артём Воронов
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import discord
+
+
+class HelpCatalog:
+    def __init__(self, is_admin_command, per_page=10):
+        """
+        Help pages of the bot commands, built once per (prefix, admin) and then served from a dict.
+        refresh must be called whenever commands are added or removed
+        :param is_admin_command: Callable telling if a command is listed by admin_help instead of help
+        :param per_page: Commands on one page
+        """
+        self.__is_admin_command = is_admin_command
+        self.per_page = per_page
+        self.__entries = []  # [(admin, name, aliases, usage, help)]
+        self.__pages = {}  # {(prefix, admin): [discord.Embed]}
+
+    def refresh(self, commands):
+        """
+        :param commands: Iterable of the bot commands
+        """
+        self.__entries = [(self.__is_admin_command(command), command.name, command.aliases, command.usage, command.help)
+                          for command in commands]
+        self.__pages.clear()
+
+    def forget(self, prefix):
+        """
+        Drop pages built for a prefix that is no longer used
+        """
+        for key in [key for key in self.__pages if key[0] == prefix]:
+            del self.__pages[key]
+
+    def pages(self, prefix, admin=False):
+        """
+        :return: Copies of the help embeds, so paginators can change footers of their own pages
+        """
+        key = (prefix, admin)
+        if key not in self.__pages:
+            self.__pages[key] = self.__build(prefix, admin)
+        return [embed.copy() for embed in self.__pages[key]]
+
+    def __build(self, prefix, admin):
+        embeds = []
+        embed = discord.Embed(title=f"**Команды Ulvication:**",
+                              color=discord.Colour.from_rgb(254, 254, 254))
+        embed_counter = 1
+
+        for is_admin, name, aliases, usage, help in self.__entries:
+            if is_admin == admin:
+                command_string = f"{prefix}{name}"
+                command_string += " | " + " | ".join(aliases) if aliases else ""
+                command_string += f" {usage}" if usage else ""
+                command_string += f"  - {help}"
+                embed.add_field(name=command_string, value=f" ‌‌‍‍", inline=False)
+                if embed_counter % self.per_page == 0:
+                    embeds.append(embed)
+                    embed = discord.Embed(title=f"**Команды**",
+                                          color=discord.Colour.from_rgb(254, 254, 254))
+                embed_counter += 1
+
+        if (embed_counter - 1) % self.per_page != 0 or not embeds:
+            embeds.append(embed)
+        return embeds
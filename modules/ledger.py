@@ -0,0 +1,102 @@
+# Copyright 2020 Артём Воронов
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Ledger of balance changes, filled by triggers from modules.schema.ledger_triggers.
+# A balance is its LedgerSnapshots balance plus the sum of its Ledger entries
+import time
+from modules.baselogger import get_logger
+from modules.schema import LEDGER_ACCOUNTS
+log = get_logger("ledger")
+
+
+class Ledger:
+    def __init__(self, shared=False):
+        """
+        :param shared: Databases are views of the shared database, where ledger rows have guild_id
+        """
+        self.shared = shared
+
+    def __guild(self, table, guild_id):
+        """
+        :return: (condition limiting table to the guild or "", params of the condition)
+        """
+        if self.shared:
+            return f" AND {table}.guild_id = ?", [guild_id]
+        return "", []
+
+    async def compact(self, gdb, guild_id, before):
+        """
+        Fold entries created before a time into snapshots and delete them
+        :param gdb: Database of the guild
+        :param guild_id: Guild id
+        :param before: Unix time, newer entries are kept for audits and rollbacks
+        :return: bool
+        """
+        guild, params = self.__guild("Ledger", guild_id)
+        guild_column = ", guild_id" if self.shared else ""
+        last_entry = f"(SELECT MAX(id) FROM Ledger WHERE created < ?{guild})"
+        conflict = "(guild_id, account, owner)" if self.shared else "(account, owner)"
+        return await gdb.execute_transaction(
+            (f"""INSERT INTO LedgerSnapshots (account, owner, balance, entry{guild_column})
+                 SELECT account, owner, TOTAL(amount), MAX(id){guild_column} FROM Ledger
+                 WHERE id <= {last_entry}{guild} GROUP BY account, owner
+                 ON CONFLICT {conflict} DO UPDATE SET balance = balance + excluded.balance, entry = excluded.entry;""",
+             (before, *params, *params)),
+            (f"""DELETE FROM Ledger WHERE id <= {last_entry}{guild};""", (before, *params, *params)),
+        )
+
+    async def history(self, gdb, owner, size=10):
+        """
+        Latest entries of an owner, e.g. to find the entry to roll back to.
+        Member ids are Discord snowflakes, so they never equal Orgs ids and one owner means one table
+        :param gdb: Database of the guild
+        :param owner: Member id or Orgs id
+        :param size: Number of entries
+        :return: List of (id, account, amount, created), newest first, None on error
+        """
+        return await gdb.read_all_by("Ledger", "owner", owner, "id, account, amount, created", "id", "DESC", size)
+
+    async def rebuild(self, gdb, guild_id, until=None):
+        """
+        Set every balance of the guild to its snapshot plus its ledger entries up to an entry.
+        Triggers stay active, so a rollback is appended to the ledger as new entries
+        :param gdb: Database of the guild
+        :param guild_id: Guild id
+        :param until: Id of the last entry to keep, default all of them
+        :return: bool, None if entries after until are already folded into snapshots
+        """
+        if until is not None and await gdb.rank("LedgerSnapshots", "entry", until) != 1:
+            return None  # a snapshot already holds entries after until
+        entries, entries_params = (" AND id <= ?", [until]) if until is not None else ("", [])
+        statements = []
+        for table, column in LEDGER_ACCOUNTS:
+            guild, params = self.__guild(table, guild_id)
+            owner = f"account = '{table}.{column}' AND owner = {table}.id"
+            if self.shared:
+                owner += f" AND guild_id = {table}.guild_id"
+            statements.append((f"""UPDATE {table} SET {column} =
+                                       COALESCE((SELECT balance FROM LedgerSnapshots WHERE {owner}), 0) +
+                                       (SELECT TOTAL(amount) FROM Ledger WHERE {owner}{entries})
+                                   WHERE true{guild};""", (*entries_params, *params)))
+        rebuilt = await gdb.execute_transaction(*statements)
+        if rebuilt:
+            log.info(f"Rebuilt balances of guild {guild_id} from the ledger" + (f" up to entry {until}" if until else ""))
+        return rebuilt
+
+
+def cutoff(keep_days):
+    """
+    :return: Unix time before which ledger entries are compacted
+    """
+    return int(time.time()) - keep_days * 86400
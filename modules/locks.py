@@ -0,0 +1,38 @@
+# Copyright 2020 Артём Воронов
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class KeyedLocks:
+    def __init__(self):
+        """
+        asyncio.Lock per key, e.g. per (guild_id, member_id). A lock exists only while someone holds or waits for it
+        """
+        self.__locks = {}  # {key: [asyncio.Lock, holders and waiters count]}
+
+    def __len__(self):
+        return len(self.__locks)
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self.__locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.__locks[key]
@@ -0,0 +1,57 @@
+# Copyright 2020 Артём Воронов
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import time
+
+
+class RewardLimiter:
+    def __init__(self, clock=time.monotonic):
+        """
+        In-memory earning windows of members. Rewards above the guild limit are rejected
+        before they reach the accrual buffer or the database
+        :param clock: Time source in seconds
+        """
+        self.__clock = clock
+        self.__windows = {}  # {(guild_id, member_id): (window end, earned in the window)}
+
+    def __len__(self):
+        return len(self.__windows)
+
+    def allow(self, guild_id, member_id, amount, policy):
+        """
+        :param amount: Reward for the message
+        :param policy: GuildConfig with reward_window and reward_limit
+        :return: True if the member may earn amount in the current window, it's counted then
+        """
+        if policy.reward_window <= 0:
+            return True
+        now = self.__clock()
+        key = (guild_id, member_id)
+        window = self.__windows.get(key)
+        if window is None or window[0] <= now:
+            window = (now + policy.reward_window, 0)
+        if window[1] + amount > policy.reward_limit:
+            return False
+        self.__windows[key] = (window[0], window[1] + amount)
+        return True
+
+    def sweep(self):
+        """
+        Drop ended windows
+        :return: Number of dropped windows
+        """
+        now = self.__clock()
+        ended = [key for key, window in self.__windows.items() if window[0] <= now]
+        for key in ended:
+            del self.__windows[key]
+        return len(ended)
@@ -0,0 +1,78 @@
+# Copyright 2020 Артём Воронов
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import re
+from discord.ext import commands
+from discord.ext.commands.view import StringView
+
+
+class CommandRouter:
+    def __init__(self, bot, guild_configs, default_prefixes):
+        """
+        Finds the command prefix of a message with one compiled regex per guild and invokes the command directly,
+        without bot.process_commands resolving the prefix again
+        :param bot: commands.Bot
+        :param guild_configs: GuildConfigCache
+        :param default_prefixes: Prefixes of DMs and of guilds without their own
+        """
+        self.bot = bot
+        self.__guild_configs = guild_configs
+        self.default_prefixes = tuple(default_prefixes)
+        self.__patterns = {}  # {guild_id or None: compiled regex matching any prefix of the guild}
+
+    def prefixes(self, guild):
+        """
+        :param guild: discord.Guild or None for DMs
+        :return: Tuple of the guild prefixes (or defaults) followed by the bot mention prefixes
+        """
+        prefixes = self.__guild_configs.get(guild.id).prefixes if guild else ()
+        prefixes = prefixes or self.default_prefixes
+        if self.bot.user:
+            prefixes += (f"<@{self.bot.user.id}> ", f"<@!{self.bot.user.id}> ")
+        return prefixes
+
+    def invalidate(self, guild_id):
+        self.__patterns.pop(guild_id, None)
+
+    def clear(self):
+        """
+        Forget patterns of all guilds, e.g. after guild configs are loaded
+        """
+        self.__patterns.clear()
+
+    def match(self, message):
+        """
+        :return: Prefix the message starts with, None if the message is not a command
+        """
+        key = message.guild.id if message.guild else None
+        pattern = self.__patterns.get(key)
+        if pattern is None:
+            prefixes = self.prefixes(message.guild)
+            pattern = re.compile("|".join(re.escape(prefix) for prefix in sorted(prefixes, key=len, reverse=True)))
+            if self.bot.user:  # mention prefixes are known only after login
+                self.__patterns[key] = pattern
+        match = pattern.match(message.content)
+        return match.group() if match else None
+
+    async def dispatch(self, message, prefix):
+        """
+        Same as bot.process_commands with an already known prefix
+        """
+        if message.author.bot:
+            return
+        view = StringView(message.content)
+        view.skip_string(prefix)
+        invoker = view.get_word()
+        ctx = commands.Context(prefix=prefix, view=view, bot=self.bot, message=message, invoked_with=invoker)
+        ctx.command = self.bot.all_commands.get(invoker)
+        await self.bot.invoke(ctx)
@@ -0,0 +1,125 @@
+# Copyright 2020 Артём Воронов
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Migrations of every database kind. Each migration is a list of statements and gets the next
+# PRAGMA user_version number, starting from 1. Never edit applied migrations, append new ones.
+# First migrations use "if not exists", so databases created before versioning are adopted as they are
+
+# Balance columns whose changes are appended to the Ledger table by triggers, as (table, column)
+LEDGER_ACCOUNTS = [("Members", "money"), ("Orgs", "points"), ("Orgs", "rep")]
+
+
+def ledger_triggers(shared=False):
+    """
+    Triggers appending every change of LEDGER_ACCOUNTS columns to Ledger in the same transaction.
+    Inserts append the initial value, updates append the difference
+    :param shared: Statements for the shared database, where Ledger has guild_id column
+    :return: List of CREATE TRIGGER statements
+    """
+    guild_column, guild_value = (", guild_id", ", NEW.guild_id") if shared else ("", "")
+    triggers = []
+    for table in dict(LEDGER_ACCOUNTS):
+        inserts = "".join(f"""
+            INSERT INTO Ledger (account, owner, amount{guild_column})
+            VALUES ('{table}.{column}', NEW.id, NEW.{column}{guild_value});""" for t, column in LEDGER_ACCOUNTS if t == table)
+        triggers.append(f"""CREATE TRIGGER if not exists ledger_{table.lower()}_insert AFTER INSERT ON {table} BEGIN{inserts}
+        END;""")
+    for table, column in LEDGER_ACCOUNTS:
+        triggers.append(f"""CREATE TRIGGER if not exists ledger_{table.lower()}_{column} AFTER UPDATE OF {column} ON {table}
+        WHEN NEW.{column} IS NOT OLD.{column} BEGIN
+            INSERT INTO Ledger (account, owner, amount{guild_column})
+            VALUES ('{table}.{column}', NEW.id, NEW.{column} - OLD.{column}{guild_value});
+        END;""")
+    return triggers
+
+
+def ledger_seed(shared=False):
+    """
+    :param shared: Statements for the shared database
+    :return: Statements appending current balances to Ledger, so databases created before it stay rebuildable
+    """
+    guild_column = ", guild_id" if shared else ""
+    return [f"""INSERT INTO Ledger (account, owner, amount{guild_column})
+                SELECT '{table}.{column}', id, {column}{guild_column} FROM {table};"""
+            for table, column in LEDGER_ACCOUNTS]
+
+
+BOT_MIGRATIONS = [
+    [
+        """CREATE TABLE if not exists Guilds (id PRIMARY KEY UNIQUE NOT NULL, prefix, admin_roles);""",
+    ],
+    [
+        """ALTER TABLE Guilds ADD COLUMN reward_window;""",
+        """ALTER TABLE Guilds ADD COLUMN reward_limit;""",
+        """ALTER TABLE Guilds ADD COLUMN reward_min_length;""",
+    ],
+]
+
+GUILD_MIGRATIONS = [
+    [
+        """CREATE TABLE if not exists Members (id PRIMARY KEY UNIQUE NOT NULL, tag, money REAL NOT NULL, organization);""",
+        """CREATE TABLE if not exists Orgs (id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE NOT NULL, name NOT NULL UNIQUE,
+                                            points INT NOT NULL, rep INT NOT NULL);""",
+        """CREATE TABLE if not exists Shop (id PRIMARY KEY UNIQUE NOT NULL, price INT NOT NULL);""",
+    ],
+    [
+        """CREATE INDEX if not exists members_money ON Members (money);""",
+        """CREATE INDEX if not exists shop_price ON Shop (price);""",
+    ],
+    [
+        """CREATE TABLE Ledger (id INTEGER PRIMARY KEY AUTOINCREMENT, account NOT NULL, owner NOT NULL,
+                               amount REAL NOT NULL, created INT NOT NULL DEFAULT (strftime('%s', 'now')));""",
+        """CREATE INDEX ledger_owner ON Ledger (account, owner);""",
+        """CREATE TABLE LedgerSnapshots (account NOT NULL, owner NOT NULL, balance REAL NOT NULL, entry INT NOT NULL,
+                                        PRIMARY KEY (account, owner));""",
+        *ledger_seed(),
+        *ledger_triggers(),
+    ],
+    [
+        """DROP INDEX members_money;""",
+        """CREATE INDEX members_money ON Members (money, id);""",
+        """CREATE INDEX orgs_points ON Orgs (points);""",
+    ],
+]
+
+# Tables of all guilds in one database. guild_id is the last column,
+# so rows of a scoped view look like rows of a per-guild database
+SHARED_GUILD_MIGRATIONS = [
+    [
+        """CREATE TABLE if not exists Members (id NOT NULL, tag, money REAL NOT NULL, organization, guild_id NOT NULL,
+                                               PRIMARY KEY (guild_id, id));""",
+        """CREATE TABLE if not exists Orgs (id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE NOT NULL, name NOT NULL,
+                                            points INT NOT NULL, rep INT NOT NULL, guild_id NOT NULL,
+                                            UNIQUE (guild_id, name));""",
+        """CREATE TABLE if not exists Shop (id NOT NULL, price INT NOT NULL, guild_id NOT NULL,
+                                            PRIMARY KEY (guild_id, id));""",
+        """CREATE INDEX if not exists members_money ON Members (guild_id, money);""",
+        """CREATE INDEX if not exists orgs_points ON Orgs (guild_id, points);""",
+        """CREATE INDEX if not exists shop_price ON Shop (guild_id, price);""",
+    ],
+    [
+        """CREATE TABLE Ledger (id INTEGER PRIMARY KEY AUTOINCREMENT, account NOT NULL, owner NOT NULL,
+                               amount REAL NOT NULL, created INT NOT NULL DEFAULT (strftime('%s', 'now')),
+                               guild_id NOT NULL);""",
+        """CREATE INDEX ledger_owner ON Ledger (guild_id, account, owner);""",
+        """CREATE TABLE LedgerSnapshots (account NOT NULL, owner NOT NULL, balance REAL NOT NULL, entry INT NOT NULL,
+                                        guild_id NOT NULL, PRIMARY KEY (guild_id, account, owner));""",
+        *ledger_seed(shared=True),
+        *ledger_triggers(shared=True),
+    ],
+    [
+        """DROP INDEX members_money;""",
+        """CREATE INDEX members_money ON Members (guild_id, money, id);""",
+    ],
+]
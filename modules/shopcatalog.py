@@ -0,0 +1,68 @@
+# Copyright 2020 Артём Воронов
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from modules.baselogger import get_logger
+log = get_logger("shop")
+
+
+class ShopCatalog:
+    def __init__(self, guild_databases, page_size=6):
+        """
+        Per guild cache of the Shop table split into pages of (role mention, price).
+        Shop commands and role gateway events invalidate a guild, the next read rebuilds it from the database
+        :param guild_databases: GuildDataBases or SharedGuildDataBases
+        :param page_size: Roles on one page
+        """
+        self.__guild_databases = guild_databases
+        self.page_size = page_size
+        self.__pages = {}  # {guild_id: [[(mention, price), ...], ...]}
+        self.__roles = {}  # {guild_id: set of role ids in the shop}
+        self.__generations = {}  # {guild_id: invalidations count}, a build started before one is not stored
+
+    async def pages(self, guild):
+        """
+        :param guild: discord.Guild
+        :return: List of pages, each a list of (role mention, price) sorted by price. Deleted roles are skipped
+        """
+        pages = self.__pages.get(guild.id)
+        if pages is None:
+            generation = self.__generations.get(guild.id, 0)
+            gdb = await self.__guild_databases.get(guild.id)
+            rows = await gdb.read_all_by_order("Shop", "price", "id, price")
+            if rows is None:  # database error, nothing is cached so the next call tries again
+                log.error(f"Couldn't read shop of guild {guild.id}")
+                return []
+            items = []
+            for role_id, price in rows:
+                role = guild.get_role(role_id)
+                if role:
+                    items.append((role.mention, price))
+            pages = [items[i:i + self.page_size] for i in range(0, len(items), self.page_size)]
+            if generation == self.__generations.get(guild.id, 0):
+                self.__roles[guild.id] = {row[0] for row in rows}
+                self.__pages[guild.id] = pages
+                log.debug(f"Built shop of guild {guild.id}: {len(items)} roles")
+        return pages
+
+    def invalidate(self, guild_id):
+        self.__generations[guild_id] = self.__generations.get(guild_id, 0) + 1
+        self.__pages.pop(guild_id, None)
+        self.__roles.pop(guild_id, None)
+
+    def invalidate_role(self, role):
+        """
+        Drop the guild's shop if the role is sold in it
+        :param role: discord.Role that was updated or deleted
+        """
+        if role.id in self.__roles.get(role.guild.id, ()):
+            self.invalidate(role.guild.id)
@@ -0,0 +1,65 @@
+# Copyright 2020 Артём Воронов
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import time
+from contextlib import contextmanager
+from modules.baselogger import get_logger
+log = get_logger("startup")
+
+
+class StartupReport:
+    def __init__(self, slowest=5):
+        """
+        Collects timings of startup phases and guilds to log them as one report
+        :param slowest: Number of slowest guilds shown in the report
+        """
+        self.slowest = slowest
+        self.started = time.perf_counter()
+        self.phases = {}  # {phase name: seconds}
+        self.guilds = {}  # {guild_id: seconds}
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+
+    def log(self):
+        total = time.perf_counter() - self.started
+        phases = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in self.phases.items())
+        slowest = sorted(self.guilds.items(), key=lambda guild: guild[1], reverse=True)[:self.slowest]
+        slowest = ", ".join(f"{guild_id} {seconds:.3f}s" for guild_id, seconds in slowest)
+        log.info(f"Startup took {total:.3f}s: {phases}. Prepared {len(self.guilds)} guilds, slowest: {slowest or '-'}")
+
+
+async def prepare_guilds(guild_ids, guild_databases, concurrency, report):
+    """
+    Open and migrate guild databases concurrently. Queries run in the database thread pool,
+    at most concurrency guilds are prepared at the same time
+    :param guild_ids: Ids of guilds to prepare
+    :param guild_databases: GuildDataBases or SharedGuildDataBases
+    :param concurrency: Maximum number of guilds prepared at the same time
+    :param report: StartupReport getting time of every guild
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def prepare(guild_id):
+        async with semaphore:
+            started = time.perf_counter()
+            await guild_databases.get(guild_id)
+            report.guilds[guild_id] = time.perf_counter() - started
+
+    await asyncio.gather(*map(prepare, guild_ids))
@@ -1,2 +1,36 @@
 TOKEN = " "
 db_path = "data/databases/Bot.db"
+db_workers = 4  # threads running queries for all databases
+max_open_guild_databases = 128  # least recently used guild databases above it are closed
+preload_guild_databases = 64  # guild databases opened on connect, keep it below max_open_guild_databases
+bootstrap_concurrency = 8  # guild databases prepared at the same time on connect
+guild_storage = "files"  # "files": database file per guild, "shared": all guilds in shared_db_path
+shared_db_path = "data/databases/Shared.db"
+accrual_flush_interval = 60  # seconds between writes of buffered activity rewards
+accrual_flush_threshold = 500  # buffered members in a guild that force a write
+reward_amount = 0.5  # coins for a chat message
+reward_window = 60  # default earning policy of guilds, see set_reward_policy: window in seconds,
+reward_limit = 5  # coins a member can earn in one window
+reward_min_length = 3  # and characters of the shortest rewarded message
+ledger_keep_days = 30  # balance changes newer than this stay in the Ledger table, older are folded into snapshots
+ledger_compact_interval = 3600  # seconds between ledger compactions
+
+metrics_port = None  # or port to serve metrics in Prometheus format on, http://127.0.0.1:metrics_port/
+metrics_file = None  # or path of a file the metrics are written to every metrics_file_interval seconds
+metrics_file_interval = 15
+
+log_file = "here.log"
+log_max_bytes = 5 * 1024 * 1024  # size of log file after which it is rotated
+log_backup_count = 5  # rotated log files kept
+log_levels = {"db": "INFO", "bot": "INFO"}  # level of every subsystem logger, INFO if not set
+log_rate_limits = {"db": 50, "accrual": 20}  # records per second of a subsystem logger, errors are never dropped
+
+# SQLite tuning profiles, see DataBase.tune and https://www.sqlite.org/pragma.html
+# Compare them with: python -m benchmarks.profiles
+db_profiles = {
+    "bot": {"journal_mode": "WAL", "synchronous": "NORMAL", "busy_timeout": 5000},
+    "guild": {"journal_mode": "WAL", "synchronous": "NORMAL", "cache_size": -512, "temp_store": "MEMORY",
+              "busy_timeout": 5000},
+    "shared": {"journal_mode": "WAL", "synchronous": "NORMAL", "cache_size": -65536, "mmap_size": 268435456,
+               "temp_store": "MEMORY", "busy_timeout": 5000},
+}